@@ -0,0 +1,99 @@
+import logging
+import re
+from collections import Counter
+from contextlib import ContextDecorator
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'\bIN \((?:\s*%s\s*,?)+\)', re.IGNORECASE)
+# Два одинаковых запроса - обычное дело: например, пользователь из сессии
+# и автор профиля берутся из auth_user по id. N+1 - это три повтора и больше
+DUPLICATE_THRESHOLD = 3
+
+
+def fingerprint(sql):
+    # Запросы, которые отличаются только значениями, считаются одинаковыми:
+    # так N+1 виден как один отпечаток, повторенный N раз
+    sql = LITERAL_RE.sub('%s', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return ' '.join(sql.split())
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget(ContextDecorator):
+    # Считает запросы, их время и повторы внутри блока или вызова функции.
+    # С limit при выходе бросает QueryBudgetExceeded, если запросов больше.
+    # Работает и без DEBUG: запросы перехватываются через execute_wrapper,
+    # а не берутся из connection.queries
+
+    def __init__(self, limit=None, using='default'):
+        self.limit = limit
+        self.using = using
+        self.queries = []
+
+    def _record(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, perf_counter() - started))
+
+    def __enter__(self):
+        self.queries = []
+        self._wrapper = connections[self.using].execute_wrapper(self._record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+        if (exc_info[0] is None and self.limit is not None
+                and self.count > self.limit):
+            raise QueryBudgetExceeded(
+                f'{self.count} запросов при бюджете {self.limit}:\n'
+                + '\n'.join(sql for sql, _ in self.queries))
+        return False
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        return sum(duration for _, duration in self.queries)
+
+    @property
+    def duplicates(self):
+        counts = Counter(fingerprint(sql) for sql, _ in self.queries)
+        return {sql: count for sql, count in counts.items()
+                if count >= DUPLICATE_THRESHOLD}
+
+
+class QueryBudgetMiddleware:
+    # Только для разработки: добавляет к ответу число запросов, их время и
+    # число повторов и пишет в лог страницы с повторяющимися запросами
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryBudget() as budget:
+            response = self.get_response(request)
+        duplicates = budget.duplicates
+        response['X-Query-Count'] = budget.count
+        response['X-Query-Time'] = f'{budget.time * 1000:.1f}ms'
+        response['X-Query-Duplicates'] = sum(duplicates.values())
+        for sql, count in duplicates.items():
+            logger.warning('%s: запрос выполнен %d раз: %s',
+                           request.path, count, sql)
+        return response
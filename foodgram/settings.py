@@ -33,7 +33,7 @@ ALLOWED_HOSTS = ['*']
 
 INSTALLED_APPS = [
     'users',
-    'recipes',
+    'recipes.apps.RecipesConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -76,6 +77,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'recipes.context_processors.purchase_counter',
             ],
         },
     },
@@ -171,4 +173,35 @@ if DEBUG:
 else:
     EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 
-PAGINATION_PAGE_SIZE = 6
\ No newline at end of file
+PAGINATION_PAGE_SIZE = 6
+PAGINATION_COUNT_TIMEOUT = 60
+AUTOCOMPLETE_LIMIT = 20
+COOKABLE_RECIPES_LIMIT = 20
+BATCH_MAX_OPERATIONS = 100
+
+# 'memory' - trigram index inside every process, 'postgres' - pg_trgm
+# (only with DB_ENGINE=django.db.backends.postgresql)
+INGREDIENT_SEARCH_BACKEND = os.environ.get(
+    'INGREDIENT_SEARCH_BACKEND', 'memory')
+INGREDIENT_SEARCH_SIMILARITY = 0.5
+INGREDIENTS_CACHE_TIMEOUT = 60 * 60
+INGREDIENTS_CACHE_MAX_AGE = 60 * 10
+
+# Cache
+# Several gunicorn workers need a shared backend (e.g. filebased or
+# memcached), otherwise invalidation only reaches the worker that saw the
+# change.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+SHOP_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Thumbnails
+# Threads per process that build thumbnails after a recipe image upload.
+THUMBNAIL_WORKERS = 2
@@ -15,7 +15,7 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientInline,)
 
     def in_favorite_count(self, obj):
-        return obj.favorite_set.count()
+        return obj.favorites_count
 
     in_favorite_count.short_description = 'В избранном'
 
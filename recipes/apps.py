@@ -3,3 +3,16 @@ from django.apps import AppConfig
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from reportlab.pdfbase.ttfonts import TTFError
+
+        from . import signals  # noqa: F401
+        from .pdf import register_fonts
+
+        # Шрифт регистрируется один раз на процесс. Если файла шрифта нет,
+        # ошибка повторится при скачивании списка покупок, а не при старте.
+        try:
+            register_fonts()
+        except TTFError:
+            pass
@@ -0,0 +1,127 @@
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from foodgram.settings import (AUTOCOMPLETE_LIMIT,
+                               INGREDIENT_SEARCH_BACKEND,
+                               INGREDIENT_SEARCH_SIMILARITY)
+
+from .cache import bump_versions, get_version
+from .models import Product
+
+PRODUCT_INDEX_VERSION_KEY = 'product_index_version'
+
+
+def normalize(text):
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def trigrams(text):
+    # Как в pg_trgm: каждое слово дополняется двумя пробелами слева и одним
+    # справа, чтобы начало слова весило больше
+    result = set()
+    for word in text.split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class ProductIndex:
+    # Отсортированный список нормализованных названий: поиск по префиксу -
+    # это bisect до первого совпадения и проход вперед, пока префикс
+    # совпадает. Если совпадений по префиксу мало, добираем результаты по
+    # триграммам: они находят слово в середине названия и опечатки
+    def __init__(self):
+        self._version = None
+        self._keys = []
+        self._items = []
+        self._postings = {}
+
+    def _load(self):
+        version = get_version(PRODUCT_INDEX_VERSION_KEY)
+        if version != self._version:
+            rows = sorted(
+                (normalize(title), title, unit)
+                for title, unit in Product.objects.values_list(
+                    'title', 'unit'))
+            postings = defaultdict(list)
+            for position, (key, _, _) in enumerate(rows):
+                for trigram in trigrams(key):
+                    postings[trigram].append(position)
+            self._keys = [key for key, _, _ in rows]
+            self._items = [{'title': title, 'unit': unit}
+                           for _, title, unit in rows]
+            self._postings = dict(postings)
+            self._version = version
+
+    def _prefix_matches(self, prefix, limit):
+        keys = self._keys
+        result = []
+        position = bisect_left(keys, prefix)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(prefix)):
+            result.append(position)
+            position += 1
+        return result
+
+    def _similar(self, query, limit, exclude):
+        query_trigrams = trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._postings.get(trigram, ()))
+        ranked = []
+        for position, count in shared.items():
+            similarity = count / len(query_trigrams)
+            if (position not in exclude
+                    and similarity >= INGREDIENT_SEARCH_SIMILARITY):
+                key = self._keys[position]
+                ranked.append(
+                    (query not in key, -similarity, len(key), position))
+        ranked.sort()
+        return [position for *_, position in ranked[:limit]]
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        query = normalize(query)
+        if not query:
+            return []
+        self._load()
+        found = self._prefix_matches(query, limit)
+        if len(found) < limit:
+            found += self._similar(query, limit - len(found), set(found))
+        return [self._items[position] for position in found]
+
+    def invalidate(self):
+        self._version = None
+        bump_versions([PRODUCT_INDEX_VERSION_KEY])
+
+
+class TrigramProductSearch:
+    # Поиск средствами PostgreSQL, нужно расширение pg_trgm. Название
+    # нормализуется в SQL так же, как normalize() в ProductIndex, чтобы оба
+    # поиска находили одно и то же
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models import BooleanField, Case, Q, Value, When
+        from django.db.models.functions import Lower, Replace
+
+        query = normalize(query)
+        if not query:
+            return []
+        return list(Product.objects.annotate(
+            key=Replace(Lower('title'), Value('ё'), Value('е')),
+        ).annotate(
+            similarity=TrigramSimilarity('key', query),
+            is_prefix=Case(
+                When(key__startswith=query, then=Value(True)),
+                default=Value(False), output_field=BooleanField()),
+        ).filter(
+            Q(key__startswith=query)
+            | Q(similarity__gte=INGREDIENT_SEARCH_SIMILARITY)
+        ).order_by(
+            '-is_prefix', '-similarity', 'title'
+        ).values('title', 'unit')[:limit])
+
+
+product_index = ProductIndex()
+product_search = (TrigramProductSearch()
+                  if INGREDIENT_SEARCH_BACKEND == 'postgres'
+                  else product_index)
@@ -0,0 +1,122 @@
+from functools import wraps
+from hashlib import md5
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from foodgram.settings import PAGE_CACHE_TIMEOUT
+
+SHOP_LIST_VERSION_KEY = 'shop_list_version:{}'
+SHOP_LIST_PDF_KEY = 'shop_list_pdf:{}'
+LISTING_VERSION_KEY = 'listing_version'
+USER_LISTING_VERSION_KEY = 'listing_version:{}'
+PAGE_VERSION_KEY = 'page_version'
+INGREDIENTS_KEY = 'ingredients:{}'
+PAGE_KEY = 'page:{}:{}'
+PAGE_CACHE_HITS_KEY = 'page_cache_hits'
+PAGE_CACHE_MISSES_KEY = 'page_cache_misses'
+# Параметры, от которых зависит страница; остальные (utm-метки и т.п.)
+# не должны плодить копии в кэше
+PAGE_CACHE_PARAMS = ('tag', 'page', 'cursor')
+
+
+def get_version(key):
+    # Версия - случайный токен, а не счетчик: если ключ вытеснен из кэша,
+    # новая версия не совпадет ни с одной из старых
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_versions(keys):
+    if keys:
+        cache.set_many({key: uuid4().hex for key in keys}, timeout=None)
+
+
+def get_shop_list_version(user_id):
+    return get_version(SHOP_LIST_VERSION_KEY.format(user_id))
+
+
+def bump_shop_list_versions(user_ids):
+    bump_versions(
+        [SHOP_LIST_VERSION_KEY.format(user_id) for user_id in set(user_ids)])
+
+
+def listing_version_key(user_id=None):
+    # Общая версия - для списков рецептов и тегов, версия пользователя -
+    # для его избранного и подписок
+    if user_id is None:
+        return LISTING_VERSION_KEY
+    return USER_LISTING_VERSION_KEY.format(user_id)
+
+
+def get_listing_version(user_id=None):
+    return get_version(listing_version_key(user_id))
+
+
+def bump_listing_version(user_id=None):
+    bump_versions([listing_version_key(user_id)])
+
+
+def get_page_version():
+    return get_version(PAGE_VERSION_KEY)
+
+
+def bump_page_version():
+    bump_versions([PAGE_VERSION_KEY])
+
+
+def count_page_cache(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def page_cache_stats():
+    stats = cache.get_many([PAGE_CACHE_HITS_KEY, PAGE_CACHE_MISSES_KEY])
+    return (stats.get(PAGE_CACHE_HITS_KEY, 0),
+            stats.get(PAGE_CACHE_MISSES_KEY, 0))
+
+
+def page_cache_key(request):
+    params = [(name, value)
+              for name in PAGE_CACHE_PARAMS
+              for value in sorted(set(request.GET.getlist(name)))]
+    page = f'{request.path}?{params}'
+    return PAGE_KEY.format(get_page_version(),
+                           md5(page.encode()).hexdigest())
+
+
+def anonymous_page_cache(view):
+    # Для гостей страница одинакова у всех, поэтому хранится готовый HTML.
+    # Ключ включает версию публичного содержимого, так что изменения
+    # рецептов, тегов и профилей сбрасывают все страницы сразу. Избранное и
+    # подписки гостю не видны и эту версию не трогают
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        key = page_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            count_page_cache(PAGE_CACHE_HITS_KEY)
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Page-Cache'] = 'HIT'
+            return response
+        count_page_cache(PAGE_CACHE_MISSES_KEY)
+        response = view(request, *args, **kwargs)
+        # Страницы с CSRF-токеном или cookie привязаны к посетителю
+        if (response.status_code == 200 and not response.cookies
+                and not request.META.get('CSRF_COOKIE_USED')):
+            cache.set(key, (response.content, response['Content-Type']),
+                      PAGE_CACHE_TIMEOUT)
+        response['X-Page-Cache'] = 'MISS'
+        return response
+    return wrapper
@@ -0,0 +1,10 @@
+from users.models import UserStats
+
+
+def purchase_counter(request):
+    if not request.user.is_authenticated:
+        return {}
+    counter = UserStats.objects.filter(
+        user=request.user
+    ).values_list('purchase_count', flat=True).first()
+    return {'counter': counter or 0}
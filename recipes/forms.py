@@ -1,13 +1,26 @@
 from django import forms
 
-from .models import Recipe, Tag
+from .managers import get_ingredients_from_form, save_ingredients
+from .models import Recipe
+from .registry import tag_registry
+
+
+class TagField(forms.MultipleChoiceField):
+    def __init__(self, **kwargs):
+        super().__init__(choices=tag_registry.choices, **kwargs)
+
+    def prepare_value(self, value):
+        if not value:
+            return value
+        return [getattr(tag, 'slug', tag) for tag in value]
+
+    def clean(self, value):
+        return [tag_registry.get(slug) for slug in super().clean(value)]
 
 
 class RecipeForm(forms.ModelForm):
-    tags = forms.ModelMultipleChoiceField(
-        queryset=Tag.objects.all(),
+    tags = TagField(
         widget=forms.CheckboxSelectMultiple(attrs={'class': 'tags__checkbox'}),
-        to_field_name='slug',
         required=False
     )
 
@@ -27,3 +40,16 @@ class RecipeForm(forms.ModelForm):
         labels = {
             'image': 'Загрузить фото'
         }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            cleaned_data['ingredients'] = get_ingredients_from_form(
+                self.data)
+        except forms.ValidationError as error:
+            self.add_error(None, error)
+        return cleaned_data
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        save_ingredients(self.instance, self.cleaned_data['ingredients'])
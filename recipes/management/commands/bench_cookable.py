@@ -0,0 +1,52 @@
+import random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, FloatField, Q
+from django.db.models.functions import Cast
+
+from recipes.managers import get_cookable_recipes
+from recipes.models import Product, Recipe
+from recipes.seed import seed_products, seed_recipes, seed_tags, seed_users
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает подбор рецептов по продуктам полным проходом по '
+            'рецептам и по обратному индексу продукт -> рецепты на '
+            'сгенерированных данных. Данные удаляются после замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--products', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            products = list(Product.objects.all()) or seed_products()
+            seed_recipes(options['recipes'], seed_users(100), seed_tags(),
+                         products=products)
+            self.run(options, products)
+            transaction.set_rollback(True)
+
+    def run(self, options, products):
+        def scan(product_ids):
+            return list(Recipe.objects.annotate(
+                matched=Count('ingredient', filter=Q(
+                    ingredient__ingredient_id__in=product_ids)),
+                total=Count('ingredient'),
+            ).filter(matched__gt=0).annotate(
+                coverage=Cast('matched', FloatField()) / Cast(
+                    'total', FloatField())
+            ).order_by('-coverage', '-matched', '-pk')[:20])
+
+        queries = [[product.pk for product in
+                    random.sample(products, options['products'])]
+                   for _ in range(options['repeat'])]
+        for title, search in (('полный проход', scan),
+                              ('обратный индекс', get_cookable_recipes)):
+            started = perf_counter()
+            for product_ids in queries:
+                search(product_ids)
+            elapsed = (perf_counter() - started) / len(queries) * 1000
+            self.stdout.write(f'{title}: {elapsed:.1f} ms на запрос')
@@ -0,0 +1,56 @@
+import random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.autocomplete import product_index
+from recipes.models import Product
+from recipes.seed import seed_products
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск ингредиентов запросом startswith и по '
+            'индексу в памяти. Без продуктов в базе загружает '
+            'ingredients.csv и удаляет его после замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            products = list(Product.objects.all()) or seed_products()
+            product_index.invalidate()
+            self.run(products, options['queries'])
+            transaction.set_rollback(True)
+        product_index.invalidate()
+
+    def run(self, products, count):
+        queries = [product.title[:random.randint(1, 4)]
+                   for product in random.choices(products, k=count)]
+        typos = [self.typo(product.title)
+                 for product in random.choices(products, k=count)]
+
+        def database(query):
+            return list(Product.objects.filter(
+                title__startswith=query
+            ).values('title', 'unit'))
+
+        product_index.search('а')
+        for title, search in (('startswith', database),
+                              ('index', product_index.search)):
+            started = perf_counter()
+            for query in queries:
+                search(query)
+            elapsed = (perf_counter() - started) / count * 1000
+            self.stdout.write(f'{title}: {elapsed:.3f} ms на запрос')
+        started = perf_counter()
+        for query in typos:
+            product_index.search(query)
+        elapsed = (perf_counter() - started) / count * 1000
+        self.stdout.write(f'index, с опечатками: {elapsed:.3f} ms на запрос')
+
+    @staticmethod
+    def typo(title):
+        position = random.randrange(len(title))
+        return title[:position] + 'а' + title[position + 1:]
@@ -0,0 +1,41 @@
+from io import BytesIO
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from recipes.pdf import FONT_FILE, FONT_NAME, register_fonts, render_shop_list
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время генерации PDF списка покупок: с регистрацией '
+            'шрифта на каждый запрос и с однократной регистрацией')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        shop_list = [
+            {'ingredient__title': f'продукт {i}', 'ingredient__unit': 'г',
+             'total': i * 1.5}
+            for i in range(options['rows'])
+        ]
+        register_fonts()
+
+        def per_request():
+            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
+            render_shop_list(shop_list, BytesIO())
+
+        def once():
+            render_shop_list(shop_list, BytesIO())
+
+        for title, func in (('before', per_request), ('after', once)):
+            started = perf_counter()
+            for _ in range(options['repeat']):
+                func()
+            elapsed = (perf_counter() - started) / options['repeat'] * 1000
+            self.stdout.write(
+                f'{title}: {elapsed:.1f} ms per render '
+                f'({options["rows"]} rows)')
@@ -0,0 +1,54 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Product, Recipe
+from recipes.search import SimpleRecipeSearch, recipe_search
+from recipes.seed import seed_products, seed_recipes, seed_tags, seed_users
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск рецептов через icontains и по полнотекстовому '
+            'индексу на сгенерированных данных. Данные удаляются после '
+            'замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=6)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            products = list(Product.objects.all()) or seed_products()
+            seed_recipes(options['recipes'], seed_users(100), seed_tags(),
+                         products=products)
+            started = perf_counter()
+            # bulk_create не отправляет сигналы, индекс строим целиком
+            recipe_search().rebuild()
+            self.stdout.write(
+                f'построение индекса: {perf_counter() - started:.1f} s')
+            self.run(options, [products[0].title, products[-1].title[:4]])
+            transaction.set_rollback(True)
+
+    def run(self, options, queries):
+        backends = {
+            'icontains': SimpleRecipeSearch(),
+            'индекс': recipe_search(),
+        }
+        page_size = options['page_size']
+        repeat = options['repeat']
+        for query in queries:
+            for title, backend in backends.items():
+                queryset = backend.search(Recipe.objects.cards(), query)
+                started = perf_counter()
+                for _ in range(repeat):
+                    list(queryset[:page_size])
+                page_time = (perf_counter() - started) / repeat * 1000
+                started = perf_counter()
+                for _ in range(repeat):
+                    count = queryset.count()
+                count_time = (perf_counter() - started) / repeat * 1000
+                self.stdout.write(
+                    f'«{query}», {title}: найдено {count}, первая страница '
+                    f'{page_time:.1f} ms, COUNT {count_time:.1f} ms')
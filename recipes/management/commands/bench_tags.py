@@ -0,0 +1,48 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Recipe
+from recipes.seed import seed_recipes, seed_tags, seed_users
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает фильтрацию рецептов по тегам через JOIN + DISTINCT '
+            'и через EXISTS на сгенерированных данных. Данные удаляются '
+            'после замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=6)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tags = seed_tags()
+            seed_recipes(options['recipes'], seed_users(100), tags)
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        slugs = ['breakfast', 'lunch']
+        queries = {
+            'distinct': Recipe.objects.filter(
+                tags__slug__in=slugs).distinct(),
+            'exists (any)': Recipe.objects.with_tags(slugs),
+            'exists (all)': Recipe.objects.with_tags(slugs, match_all=True),
+        }
+        page_size = options['page_size']
+        for title, queryset in queries.items():
+            started = perf_counter()
+            for _ in range(options['repeat']):
+                list(queryset[:page_size])
+            page_time = perf_counter() - started
+            started = perf_counter()
+            for _ in range(options['repeat']):
+                queryset.count()
+            count_time = perf_counter() - started
+            self.stdout.write(
+                f'{title}: первая страница '
+                f'{page_time / options["repeat"] * 1000:.1f} ms, '
+                f'COUNT {count_time / options["repeat"] * 1000:.1f} ms')
@@ -0,0 +1,162 @@
+import json
+import math
+import random
+from collections import defaultdict
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from foodgram.query_budget import QueryBudget
+from foodgram.settings import PAGINATION_PAGE_SIZE
+from recipes.models import Product, Recipe, Tag
+
+User = get_user_model()
+
+TRAFFIC_FILE = settings.BASE_DIR / 'recipes' / 'traffic.jsonl'
+PERCENTILES = (50, 95, 99)
+# Адрес не из INTERNAL_IPS, чтобы debug toolbar не попадал в замер
+REMOTE_ADDR = '10.0.0.1'
+
+
+def percentile(values, percent):
+    # Ближайший ранг по отсортированному списку
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def load_traffic(path):
+    with open(path, encoding='utf-8') as traffic_file:
+        routes = [json.loads(line) for line in traffic_file if line.strip()]
+    if not routes:
+        raise CommandError(f'{path}: нет запросов')
+    return routes
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет смесь запросов из jsonl-файла через приложение в '
+            'том же процессе и печатает p50/p95/p99 и число запросов к '
+            'базе по каждому адресу. Данные берутся из базы, их готовит '
+            'seed_bench')
+
+    def add_arguments(self, parser):
+        parser.add_argument('traffic', nargs='?', default=TRAFFIC_FILE,
+                            help='Файл jsonl: name, path, method, body, '
+                                 'auth, weight')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--warmup', type=int, default=100)
+        parser.add_argument('--users', type=int, default=20,
+                            help='Сколько пользователей логинятся')
+        parser.add_argument('--prefix', default='bench')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', help='Сохранить результат в json')
+        parser.add_argument('--baseline',
+                            help='json прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        routes = load_traffic(options['traffic'])
+        weights = [route.get('weight', 1) for route in routes]
+        self.load_params(options)
+        self.anonymous = Client(REMOTE_ADDR=REMOTE_ADDR,
+                                raise_request_exception=False)
+        self.clients = []
+        for user in self.users[:options['users']]:
+            client = Client(REMOTE_ADDR=REMOTE_ADDR,
+                            raise_request_exception=False)
+            client.force_login(user)
+            self.clients.append(client)
+        if settings.DEBUG:
+            self.stderr.write('DEBUG=True: замер будет медленнее, чем в '
+                              'продакшене')
+
+        for route in random.choices(routes, weights, k=options['warmup']):
+            self.request(route)
+        samples = defaultdict(list)
+        for route in random.choices(routes, weights,
+                                    k=options['requests']):
+            samples[route['name']].append(self.request(route))
+
+        results = {name: self.summary(route_samples)
+                   for name, route_samples in sorted(samples.items())}
+        results['total'] = self.summary(
+            [sample for route_samples in samples.values()
+             for sample in route_samples])
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as json_file:
+                baseline = json.load(json_file)
+        self.report(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as json_file:
+                json.dump(results, json_file, indent=2)
+
+    def load_params(self, options):
+        self.users = list(User.objects.filter(
+            username__startswith=options['prefix']).order_by('pk'))
+        self.recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        if not self.users or not self.recipe_ids:
+            raise CommandError('База пуста, сначала запустите seed_bench')
+        self.products = list(Product.objects.values_list('pk', 'title'))
+        self.tags = list(Tag.objects.values_list('slug', flat=True))
+        self.pages = max(len(self.recipe_ids) // PAGINATION_PAGE_SIZE, 1)
+
+    def params(self):
+        product_id, title = random.choice(self.products)
+        return {
+            'recipe_id': random.choice(self.recipe_ids),
+            'user_id': random.choice(self.users).pk,
+            'product_id': product_id,
+            'query': title.split()[0],
+            'tag': random.choice(self.tags),
+            'page': random.randint(1, min(self.pages, 10)),
+        }
+
+    def request(self, route):
+        params = self.params()
+        client = (random.choice(self.clients) if route.get('auth')
+                  else self.anonymous)
+        body = {key: value.format_map(params) if isinstance(value, str)
+                else value for key, value in route.get('body', {}).items()}
+        with QueryBudget() as budget:
+            started = perf_counter()
+            response = client.generic(
+                route.get('method', 'GET'),
+                route['path'].format_map(params),
+                json.dumps(body) if body else '',
+                content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = perf_counter() - started
+        return elapsed * 1000, budget.count, response.status_code >= 500
+
+    @staticmethod
+    def summary(samples):
+        times = sorted(elapsed for elapsed, _, _ in samples)
+        result = {'requests': len(samples)}
+        for percent in PERCENTILES:
+            result[f'p{percent}'] = round(percentile(times, percent), 2)
+        result['queries'] = round(
+            sum(queries for _, queries, _ in samples) / len(samples), 1)
+        result['errors'] = sum(error for _, _, error in samples)
+        return result
+
+    def report(self, results, baseline):
+        columns = ['requests', *(f'p{p}' for p in PERCENTILES), 'queries',
+                   'errors']
+        width = max(map(len, results))
+        self.stdout.write(' ' * width + ''.join(
+            f'{column:>10}' for column in columns))
+        for name, result in results.items():
+            line = f'{name:<{width}}' + ''.join(
+                f'{result[column]:>10}' for column in columns)
+            previous = baseline.get(name)
+            if previous:
+                # Изменение p95 и числа запросов относительно прошлого прогона
+                change = (result['p95'] - previous['p95']) / max(
+                    previous['p95'], 0.01) * 100
+                line += (f'  p95 {change:+.0f}%, запросов '
+                         f'{result["queries"] - previous["queries"]:+.1f}')
+            self.stdout.write(line)
@@ -0,0 +1,85 @@
+import csv
+from itertools import islice
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.autocomplete import product_index
+from recipes.cache import bump_page_version, bump_shop_list_versions
+from recipes.models import Product, Purchase
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+class Command(BaseCommand):
+    help = ('Загружает справочник продуктов из CSV (название,единица): '
+            'новые продукты создаются, у существующих обновляются единицы')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=settings.BASE_DIR / 'ingredients.csv')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        stats = {'rows': 0, 'created': 0, 'updated': 0}
+        try:
+            csv_file = open(options['path'], encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(error)
+        changed = []
+        with csv_file, transaction.atomic():
+            seen = set()
+            for batch in batches(csv.reader(csv_file),
+                                 options['batch_size']):
+                units = {}
+                for row in batch:
+                    if len(row) != 2:
+                        raise CommandError(
+                            f'Ожидалось "название,единица": {row}')
+                    title, unit = (value.strip() for value in row)
+                    if title not in seen:
+                        seen.add(title)
+                        units[title] = unit
+                stats['rows'] += len(batch)
+                changed += self.save_batch(
+                    units, options['batch_size'], stats)
+        # bulk-операции не отправляют post_save: списки покупок и страницы
+        # гостей с изменившимися единицами сбрасываются здесь
+        product_index.invalidate()
+        if changed:
+            bump_page_version()
+            bump_shop_list_versions(Purchase.objects.filter(
+                recipe__ingredient__ingredient__in=changed
+            ).values_list('user_id', flat=True))
+        elapsed = perf_counter() - started
+        self.stdout.write(
+            f'Строк: {stats["rows"]}, создано: {stats["created"]}, '
+            f'обновлено: {stats["updated"]} за {elapsed:.2f} с '
+            f'({stats["rows"] / elapsed:.0f} строк/с)')
+
+    @staticmethod
+    def save_batch(units, batch_size, stats):
+        existing = {}
+        for product in Product.objects.filter(title__in=units):
+            existing.setdefault(product.title, product)
+        changed = []
+        for title, product in existing.items():
+            if product.unit != units[title]:
+                product.unit = units[title]
+                changed.append(product)
+        Product.objects.bulk_update(changed, ['unit'], batch_size=batch_size)
+        new = [Product(title=title, unit=unit)
+               for title, unit in units.items() if title not in existing]
+        Product.objects.bulk_create(new, batch_size=batch_size)
+        stats['created'] += len(new)
+        stats['updated'] += len(changed)
+        return [product.pk for product in changed]
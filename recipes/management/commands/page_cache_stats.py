@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.cache import page_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша страниц для гостей'
+
+    def handle(self, *args, **options):
+        hits, misses = page_cache_stats()
+        total = hits + misses
+        ratio = hits / total * 100 if total else 0
+        self.stdout.write(
+            f'попаданий: {hits}, промахов: {misses}, доля попаданий: '
+            f'{ratio:.1f}%')
@@ -0,0 +1,42 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.managers import count_of
+from recipes.models import Favorite, Ingredient, Purchase, Recipe
+from users.models import UserStats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики избранного, ингредиентов, покупок и '
+            'рецептов')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            UserStats.objects.bulk_create(
+                [UserStats(user_id=user_id) for user_id in
+                 User.objects.filter(stats__isnull=True).values_list(
+                     'pk', flat=True)],
+                ignore_conflicts=True)
+            fixed = {
+                'favorites_count': self.fix(
+                    Recipe.objects, 'favorites_count',
+                    count_of(Favorite, 'recipe')),
+                'ingredients_count': self.fix(
+                    Recipe.objects, 'ingredients_count',
+                    count_of(Ingredient, 'recipe')),
+                'purchase_count': self.fix(
+                    UserStats.objects, 'purchase_count',
+                    count_of(Purchase, 'user')),
+                'recipe_count': self.fix(
+                    UserStats.objects, 'recipe_count',
+                    count_of(Recipe, 'author')),
+            }
+        for field, count in fixed.items():
+            self.stdout.write(f'{field}: исправлено {count}')
+
+    @staticmethod
+    def fix(manager, field, actual):
+        return manager.exclude(**{field: actual}).update(**{field: actual})
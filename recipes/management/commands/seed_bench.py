@@ -0,0 +1,60 @@
+import random
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.cache import bump_listing_version, bump_page_version
+from recipes.models import Favorite, Product, Purchase, Recipe
+from recipes.search import recipe_search
+from recipes.seed import (seed_products, seed_recipes, seed_relations,
+                          seed_tags, seed_users)
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу данными для нагрузочного замера: пользователи, '
+            'рецепты с ингредиентами и тегами, избранное, покупки и '
+            'подписки. Данные остаются в базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Рецептов в избранном у пользователя')
+        parser.add_argument('--purchases', type=int, default=5,
+                            help='Рецептов в покупках у пользователя')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок у пользователя')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='bench')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Зерно random для повторяемых данных')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            products = list(Product.objects.all()) or seed_products()
+            users = seed_users(options['users'], options['prefix'])
+            seed_recipes(options['recipes'], users, seed_tags(),
+                         batch_size=batch_size, products=products)
+            recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+            user_ids = [user.pk for user in users]
+            for model, field, per_user in (
+                    (Favorite, 'recipe', options['favorites']),
+                    (Purchase, 'recipe', options['purchases']),
+                    (Subscription, 'author', options['subscriptions'])):
+                targets = user_ids if field == 'author' else recipe_ids
+                seed_relations(model, users, targets, per_user, field,
+                               batch_size=batch_size)
+            # bulk_create обходит сигналы: счетчики, поисковый индекс и
+            # версии кэша приводятся в порядок одним проходом в конце
+            call_command('reconcile_counters', stdout=self.stdout)
+            recipe_search().rebuild()
+            bump_listing_version()
+            bump_page_version()
+        for title, model in (('рецептов', Recipe), ('избранного', Favorite),
+                             ('покупок', Purchase),
+                             ('подписок', Subscription)):
+            self.stdout.write(f'{title}: {model.objects.count()}')
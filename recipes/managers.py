@@ -1,16 +1,226 @@
-from django.shortcuts import get_object_or_404
+import math
 
-from users.models import Subscription
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import (CharField, Count, F, FloatField, IntegerField,
+                              OuterRef, Prefetch, Subquery, Sum, Value)
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.signals import post_delete, post_save
+from django.utils.timezone import now
 
-from .models import Ingredient, Product, Recipe
+from foodgram.settings import COOKABLE_RECIPES_LIMIT, PAGINATION_PAGE_SIZE
+from users.models import Subscription, UserStats
+
+from .cache import (bump_listing_version, bump_page_version,
+                    bump_shop_list_versions)
+from .models import (Favorite, Ingredient, Product, Purchase, Recipe,
+                     User)
+from .paginators import CachedCountPaginator, CursorPaginator
+from .search import recipe_search
+
+
+class UserState:
+    FAVORITE = 'favorite'
+    PURCHASE = 'purchase'
+
+    def __init__(self, user):
+        self.favorites = set()
+        self.purchases = set()
+        sets = {self.FAVORITE: self.favorites, self.PURCHASE: self.purchases}
+        for recipe_id, kind in self._ids_query(user):
+            sets[kind].add(recipe_id)
+
+    @classmethod
+    def _ids_query(cls, user):
+        def ids(model, kind):
+            return model.objects.filter(user=user).order_by().values_list(
+                'recipe_id', Value(kind, output_field=CharField()))
+
+        return ids(Favorite, cls.FAVORITE).union(
+            ids(Purchase, cls.PURCHASE), all=True)
 
 
 def extend_context(context, user):
-    context['purchase_list'] = Recipe.objects.filter(purchase_by=user)
-    context['favorites'] = Recipe.objects.filter(favorite_by=user)
+    context['user_state'] = UserState(user)
     return context
 
 
+def change_favorites_count(recipe_id, delta):
+    Recipe.objects.filter(pk=recipe_id).update(
+        favorites_count=F('favorites_count') + delta)
+
+
+def change_ingredients_count(recipe_id, delta):
+    Recipe.objects.filter(pk=recipe_id).update(
+        ingredients_count=F('ingredients_count') + delta)
+
+
+def touch_recipes(queryset):
+    queryset.update(updated=now())
+
+
+def change_user_counter(user, field, delta):
+    updated = UserStats.objects.filter(user=user).update(
+        **{field: F(field) + delta})
+    if not updated:
+        UserStats.objects.create(user=user, **{field: max(delta, 0)})
+
+
+def add_relation(model, user, **target):
+    # Одна вставка вида INSERT ... SELECT ... ON CONFLICT DO NOTHING: строка
+    # появляется, только если цель существует и связи еще нет, повторный
+    # клик упирается в уникальное ограничение. False - связь уже была или
+    # цели нет
+    (name, target_id), = target.items()
+    opts = model._meta
+    field = opts.get_field(name)
+    target_opts = field.related_model._meta
+    qn = connection.ops.quote_name
+    columns = [opts.get_field('user').column, field.column]
+    values = ['%s', qn(target_opts.pk.column)]
+    params = [user.pk]
+    for auto_field in opts.concrete_fields:
+        if getattr(auto_field, 'auto_now_add', False):
+            columns.append(auto_field.column)
+            values.append('%s')
+            params.append(auto_field.get_db_prep_save(now(), connection))
+    ignore_conflicts = connection.ops.ignore_conflicts_suffix_sql(
+        ignore_conflicts=True)
+    sql = (
+        f'{connection.ops.insert_statement(ignore_conflicts=True)} '
+        f'{qn(opts.db_table)} ({", ".join(map(qn, columns))}) '
+        f'SELECT {", ".join(values)} FROM {qn(target_opts.db_table)} '
+        f'WHERE {qn(target_opts.pk.column)} = %s {ignore_conflicts}')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [target_id])
+        added = cursor.rowcount == 1
+    if added:
+        # Сырой SQL не отправляет сигналы, а от них зависят кэши
+        instance = model(user=user, **{field.attname: target_id})
+        post_save.send(sender=model, instance=instance, created=True,
+                       update_fields=None, raw=False, using=connection.alias)
+    return added
+
+
+def delete_relation(model, user, **target):
+    # Один DELETE; rowcount показывает, была ли связь
+    (name, target_id), = target.items()
+    opts = model._meta
+    field = opts.get_field(name)
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {qn(opts.db_table)} '
+            f'WHERE {qn(opts.get_field("user").column)} = %s '
+            f'AND {qn(field.column)} = %s',
+            [user.pk, target_id])
+        deleted = cursor.rowcount
+    if deleted:
+        instance = model(user=user, **{field.attname: target_id})
+        post_delete.send(sender=model, instance=instance,
+                         using=connection.alias)
+    return deleted
+
+
+def delete_rows(model, **filters):
+    # Один DELETE по значениям полей (список - IN) без выборки строк и без
+    # post_delete на каждую: кэши и счетчики вызывающий обновляет сам
+    opts = model._meta
+    qn = connection.ops.quote_name
+    conditions = []
+    params = []
+    for name, value in filters.items():
+        column = qn(opts.get_field(name).column)
+        if isinstance(value, (list, tuple, set)):
+            if not value:
+                return 0
+            conditions.append(
+                f'{column} IN ({", ".join(["%s"] * len(value))})')
+            params.extend(value)
+        else:
+            conditions.append(f'{column} = %s')
+            params.append(value)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {qn(opts.db_table)} '
+            f'WHERE {" AND ".join(conditions)}', params)
+        return cursor.rowcount
+
+
+def count_of(model, field, outer='pk'):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef(outer)}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count'),
+        output_field=IntegerField()
+    ), 0)
+
+
+# Что можно переключать пакетом: модель связи и поле с целью
+TOGGLES = {
+    'favorite': (Favorite, 'recipe'),
+    'purchase': (Purchase, 'recipe'),
+    'subscription': (Subscription, 'author'),
+}
+
+
+def apply_toggles(user, toggles):
+    # toggles - {(kind, id): True/False}, итоговое состояние каждой связи.
+    # Все вставки одним bulk_create на вид, удаления одним DELETE через
+    # delete_rows (delete() сначала выбирает строки ради сигналов), а
+    # счетчики пересчитываются по факту, поэтому параллельные одиночные
+    # клики не сбивают их
+    recipe_ids = {pk for kind, pk in toggles if kind != 'subscription'}
+    author_ids = {pk for kind, pk in toggles if kind == 'subscription'}
+    targets = {
+        'recipe': set(Recipe.objects.filter(
+            pk__in=recipe_ids).values_list('pk', flat=True))
+        if recipe_ids else set(),
+        'author': set(User.objects.filter(
+            pk__in=author_ids).values_list('pk', flat=True))
+        if author_ids else set(),
+    }
+    changed = {}
+    with transaction.atomic():
+        for kind, (model, field) in TOGGLES.items():
+            wanted = {pk: state for (name, pk), state in toggles.items()
+                      if name == kind and pk in targets[field]}
+            if not wanted:
+                continue
+            changed[kind] = set(wanted)
+            model.objects.bulk_create(
+                [model(user=user, **{f'{field}_id': pk})
+                 for pk, state in wanted.items() if state],
+                ignore_conflicts=True)
+            delete_rows(model, user=user.pk, **{
+                field: [pk for pk, state in wanted.items() if not state]})
+        if 'favorite' in changed:
+            Recipe.objects.filter(pk__in=changed['favorite']).update(
+                favorites_count=count_of(Favorite, 'recipe'))
+        if 'purchase' in changed:
+            UserStats.objects.update_or_create(user=user, defaults={
+                'purchase_count': Purchase.objects.filter(user=user).count()})
+    # bulk_create и delete_rows не отправляют сигналы
+    if 'purchase' in changed:
+        bump_shop_list_versions([user.pk])
+    if 'favorite' in changed or 'subscription' in changed:
+        bump_listing_version(user.pk)
+    state = UserState(user)
+    stats = UserStats.objects.filter(user=user).first()
+    return {
+        'favorites': sorted(state.favorites),
+        'purchases': sorted(state.purchases),
+        'subscriptions': sorted(user.follower.values_list(
+            'author_id', flat=True)),
+        'purchase_count': stats.purchase_count if stats else 0,
+        'favorites_count': dict(Recipe.objects.filter(
+            pk__in=changed.get('favorite', ())
+        ).values_list('pk', 'favorites_count')),
+    }
+
+
 def add_subscription_status(context, user, author):
     context['is_subscribed'] = Subscription.objects.filter(
         user=user, author=author
@@ -18,24 +228,128 @@ def add_subscription_status(context, user, author):
     return context
 
 
+def get_subscriptions(user, recipes_limit=3):
+    latest_recipes = Recipe.objects.filter(pk__in=Subquery(
+        Recipe.objects.filter(
+            author=OuterRef('author')
+        ).values('pk')[:recipes_limit]
+    ))
+    # Строки UserStats может еще не быть (до reconcile_counters), тогда
+    # число рецептов считается подзапросом
+    return user.follower.select_related('author').annotate(
+        recipe_count=Coalesce('author__stats__recipe_count',
+                              count_of(Recipe, 'author', outer='author'))
+    ).prefetch_related(
+        Prefetch('author__recipes', queryset=latest_recipes,
+                 to_attr='latest_recipes')
+    ).order_by('-pk')
+
+
+def paginate(request, queryset, ordering=('-pub_date', '-pk'),
+             user_id=None):
+    # ordering=None - выборка отсортирована не по ключу (например, по
+    # релевантности), курсор к ней неприменим. user_id - для списков,
+    # которые зависят от избранного и подписок пользователя
+    if ordering and 'cursor' in request.GET:
+        paginator = CursorPaginator(queryset, PAGINATION_PAGE_SIZE, ordering,
+                                    user_id=user_id)
+        return paginator, paginator.get_page(request.GET['cursor'])
+    paginator = CachedCountPaginator(queryset, PAGINATION_PAGE_SIZE,
+                                     user_id=user_id)
+    return paginator, paginator.get_page(request.GET.get('page'))
+
+
 def tag_filter(model, tags):
-    if tags:
-        return model.objects.prefetch_related(
-                'author', 'tags'
-            ).filter(
-                tags__slug__in=tags
-            ).distinct()
-    else:
-        return model.objects.prefetch_related(
-                'author', 'tags'
-            ).all()
-
-
-def get_ingredients_from_form(ingredients, recipe):
-    ingredients_for_save = []
-    for ingredient in ingredients:
-        product = get_object_or_404(Product, title=ingredient['title'])
-        ingredients_for_save.append(
-            Ingredient(recipe=recipe, ingredient=product,
-                       amount=ingredient['amount']))
-    return ingredients_for_save
+    return model.objects.cards().with_tags(tags)
+
+
+def get_ingredients_from_form(data):
+    # так же, как SelectMultiple, принимаем и QueryDict, и обычный словарь
+    try:
+        getter = data.getlist
+    except AttributeError:
+        getter = data.get
+    titles = getter('nameIngredient') or []
+    amounts = getter('valueIngredient') or []
+    if not titles:
+        raise ValidationError('Добавьте хотя бы один ингредиент')
+    if len(titles) != len(amounts):
+        raise ValidationError('Укажите количество для каждого ингредиента')
+    requested = {}
+    for title, amount in zip(titles, amounts):
+        try:
+            amount = float(amount)
+        except ValueError:
+            amount = 0
+        # nan и inf проходят сравнение с нулем, их отсекаем отдельно
+        if not math.isfinite(amount) or amount <= 0:
+            raise ValidationError(f'Неверное количество для «{title}»')
+        requested[title] = requested.get(title, 0) + amount
+    products = {}
+    for product in Product.objects.filter(title__in=requested):
+        products.setdefault(product.title, product)
+    unknown = set(requested) - set(products)
+    if unknown:
+        raise ValidationError(
+            f'Нет таких ингредиентов: {", ".join(sorted(unknown))}')
+    return {products[title]: amount for title, amount in requested.items()}
+
+
+def save_ingredients(recipe, amounts):
+    existing = {ingredient.ingredient_id: ingredient
+                for ingredient in recipe.ingredient_set.all()}
+    amounts = {product.id: amount for product, amount in amounts.items()}
+    delete_rows(Ingredient, id=[
+        ingredient.pk for product_id, ingredient in existing.items()
+        if product_id not in amounts])
+    changed = []
+    for product_id, ingredient in existing.items():
+        if product_id in amounts and ingredient.amount != amounts[product_id]:
+            ingredient.amount = amounts[product_id]
+            changed.append(ingredient)
+    Ingredient.objects.bulk_update(changed, ['amount'])
+    Ingredient.objects.bulk_create(
+        [Ingredient(recipe=recipe, ingredient_id=product_id, amount=amount)
+         for product_id, amount in amounts.items()
+         if product_id not in existing])
+    # bulk-операции и delete_rows не отправляют сигналы, сбрасываем кэш
+    # списков покупок и обновляем поисковый индекс вручную
+    bump_shop_list_versions(
+        recipe.purchase_set.values_list('user_id', flat=True))
+    recipe_search().update([recipe.pk])
+    bump_page_version()
+    Recipe.objects.filter(pk=recipe.pk).update(
+        ingredients_count=len(amounts))
+
+
+def get_cookable_recipes(product_ids, limit=COOKABLE_RECIPES_LIMIT):
+    # Ingredient под индексом (ingredient, recipe) - это и есть обратный
+    # индекс: читаем только строки выбранных продуктов, а общее число
+    # ингредиентов рецепта берем из счетчика, не пересчитывая его. Пока
+    # reconcile_counters не заполнил счетчик старых рецептов (там 0),
+    # число считается подзапросом по их ингредиентам
+    matches = list(Ingredient.objects.filter(
+        ingredient_id__in=product_ids
+    ).values(
+        'recipe_id'
+    ).annotate(
+        matched=Count('pk'),
+        total=Coalesce(NullIf('recipe__ingredients_count', Value(0)),
+                       count_of(Ingredient, 'recipe', outer='recipe_id')),
+    ).annotate(
+        coverage=Cast('matched', FloatField()) / Cast('total', FloatField())
+    ).order_by('-coverage', '-matched', '-recipe_id')[:limit])
+    recipes = Recipe.objects.only('name').in_bulk(
+        [match['recipe_id'] for match in matches])
+    return [(recipes[match['recipe_id']], match['matched'], match['total'])
+            for match in matches]
+
+
+def get_shop_list(user):
+    return Ingredient.objects.filter(
+        recipe__purchase__user=user
+    ).values(
+        'ingredient__title', 'ingredient__unit'
+    ).annotate(
+        total=Sum('amount')
+    ).order_by('ingredient__title')
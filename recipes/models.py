@@ -5,7 +5,8 @@ User = get_user_model()
 
 
 class Product(models.Model):
-    title = models.CharField(max_length=255, verbose_name='Название продукта')
+    title = models.CharField(max_length=255, verbose_name='Название продукта',
+                             db_index=True)
     unit = models.CharField(max_length=255, verbose_name='Единицы измерения')
 
     class Meta:
@@ -17,13 +18,45 @@ class Product(models.Model):
 
 
 class Tag(models.Model):
+    COLORS = (
+        ('orange', 'Оранжевый'),
+        ('green', 'Зеленый'),
+        ('purple', 'Фиолетовый'),
+    )
+
     name = models.CharField(max_length=100, verbose_name='Название тега')
     slug = models.SlugField(verbose_name='Слаг тега')
+    color = models.CharField(max_length=20, choices=COLORS, default='orange',
+                             verbose_name='Цвет тега')
 
     def __str__(self):
         return f'{self.name}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    def cards(self):
+        return self.select_related('author').defer(
+            'description'
+        ).prefetch_related(
+            models.Prefetch('tags', queryset=Tag.objects.only(
+                'name', 'slug', 'color'))
+        )
+
+    def with_tags(self, slugs, match_all=False):
+        if not slugs:
+            return self
+        tagged = self.model.tags.through.objects.filter(
+            recipe=models.OuterRef('pk'))
+        if not match_all:
+            return self.filter(models.Exists(
+                tagged.filter(tag__slug__in=slugs)))
+        queryset = self
+        for slug in set(slugs):
+            queryset = queryset.filter(models.Exists(
+                tagged.filter(tag__slug=slug)))
+        return queryset
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                verbose_name='Автор рецепта',
@@ -38,15 +71,29 @@ class Recipe(models.Model):
     cook_time = models.PositiveIntegerField(verbose_name='Время приготовления')
     pub_date = models.DateTimeField(
         auto_now_add=True, verbose_name='Время публикации', db_index=True)
+    updated = models.DateTimeField(
+        auto_now=True, verbose_name='Время изменения')
     favorite_by = models.ManyToManyField(User, through='Favorite',
                                          related_name='favorite_recipes',
                                          blank=True)
     purchase_by = models.ManyToManyField(User, through='Purchase',
                                          related_name='shop_list',
                                          blank=True)
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В избранном')
+    ingredients_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Ингредиентов')
+    thumbnails = models.JSONField(
+        default=dict, editable=False, verbose_name='Миниатюры')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-pk']
+        indexes = [
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+        ]
         verbose_name_plural = 'Рецепты'
         verbose_name = 'Рецепты'
 
@@ -60,6 +107,11 @@ class Ingredient(models.Model):
     amount = models.FloatField(verbose_name='Количество ингредиента')
 
     class Meta:
+        # Обратный индекс продукт -> рецепты для подбора по продуктам
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe'],
+                         name='ingredient_recipe_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['ingredient', 'amount', 'recipe'],
@@ -77,6 +129,16 @@ class Purchase(models.Model):
     created = models.DateTimeField('date of creation', auto_now_add=True)
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_purchase'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created'],
+                         name='purchase_user_created_idx'),
+        ]
         ordering = ['-created']
         verbose_name_plural = 'Список покупок'
         verbose_name = 'Список покупок'
@@ -91,6 +153,16 @@ class Favorite(models.Model):
     created = models.DateTimeField('date published', auto_now_add=True)
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_favorite'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created'],
+                         name='favorite_user_created_idx'),
+        ]
         ordering = ['-created']
         verbose_name_plural = 'Избранное'
         verbose_name = 'Избранное'
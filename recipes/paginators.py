@@ -0,0 +1,158 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from hashlib import md5
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from foodgram.settings import PAGINATION_COUNT_TIMEOUT
+
+from .cache import get_listing_version
+
+COUNT_KEY = 'paginator_count:{}'
+
+
+def cached_count(queryset, user_id=None):
+    # Списки пользователя зависят и от общих изменений рецептов, и от его
+    # избранного и подписок, поэтому ключ включает обе версии
+    version = get_listing_version()
+    if user_id is not None:
+        version = f'{version}:{get_listing_version(user_id)}'
+    query = f'{version}:{queryset.query}'
+    key = COUNT_KEY.format(md5(query.encode()).hexdigest())
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, PAGINATION_COUNT_TIMEOUT)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    keyset = False
+
+    def __init__(self, object_list, per_page, user_id=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.user_id = user_id
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list, self.user_id)
+
+
+def encode_cursor(values, backwards=False):
+    data = json.dumps([backwards, values], default=str)
+    return urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (DecodeError, ValueError, TypeError):
+        return False, None
+    # Курсор приходит из адреса, ему нельзя доверять: все, что не похоже на
+    # [направление, [значения]], считается первой страницей
+    if (not isinstance(data, list) or len(data) != 2
+            or not isinstance(data[0], bool)
+            or not isinstance(data[1], list)):
+        return False, None
+    return data[0], data[1]
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Пагинация по ключу сортировки вместо OFFSET.
+
+    Поля ordering должны однозначно упорядочивать выборку и сортироваться
+    по убыванию, например ('-pub_date', '-pk').
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, ordering, user_id=None):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.user_id = user_id
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list, self.user_id)
+
+    def _after(self, values, backwards):
+        lookup = 'gt' if backwards else 'lt'
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            step = Q(**dict(zip(self.fields[:i], values[:i])))
+            step &= Q(**{f'{field}__{lookup}': values[i]})
+            condition |= step
+        return condition
+
+    def _clean(self, values):
+        # Значения приводятся к типам полей до фильтра, иначе мусор в
+        # курсоре падает при выполнении запроса
+        if values is None or len(values) != len(self.fields):
+            return None
+        meta = self.object_list.model._meta
+        try:
+            values = [
+                (meta.pk if field == 'pk' else meta.get_field(field)
+                 ).to_python(value)
+                for field, value in zip(self.fields, values)]
+        except (ValidationError, ValueError, TypeError):
+            return None
+        return None if None in values else values
+
+    def _cursor(self, obj, backwards=False):
+        return encode_cursor(
+            [getattr(obj, field) for field in self.fields], backwards)
+
+    def get_page(self, cursor=None):
+        backwards, values = decode_cursor(cursor) if cursor else (False, None)
+        values = self._clean(values)
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self._after(values, backwards))
+        else:
+            backwards, values = False, None
+        ordering = [field if backwards else f'-{field}'
+                    for field in self.fields]
+        items = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if backwards:
+            items.reverse()
+        if not items:
+            return CursorPage(items, self, None, None)
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else values is not None
+        return CursorPage(
+            items, self,
+            self._cursor(items[-1]) if has_next else None,
+            self._cursor(items[0], backwards=True) if has_previous else None,
+        )
@@ -0,0 +1,63 @@
+import os
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+FONT_NAME = 'Arial'
+FONT_FILE = 'arial.ttf'
+FONT_DIR = os.path.join(settings.BASE_DIR, 'Library', 'Fonts')
+FONT_SIZE = 20
+
+# Список покупок держим в памяти до 1 Мб, дальше он уходит во временный файл
+SPOOL_MAX_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def register_fonts():
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return
+    if FONT_DIR not in rl_config.TTFSearchPath:
+        rl_config.TTFSearchPath.append(FONT_DIR)
+    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
+
+
+def render_shop_list(shop_list, output):
+    p = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+    p.setFont(FONT_NAME, FONT_SIZE)
+    x = 50
+    y = 750
+    for num, item in enumerate(shop_list):
+        if y <= 100:
+            y = 700
+            p.showPage()
+            p.setFont(FONT_NAME, FONT_SIZE)
+        p.drawString(
+            x, y,
+            f"№{num + 1}: {item['ingredient__title']} - {item['total']} "
+            f"{item['ingredient__unit']}"
+        )
+        y -= 30
+    p.showPage()
+    p.save()
+
+
+def read_chunks(buffer):
+    with buffer:
+        yield from iter(lambda: buffer.read(CHUNK_SIZE), b'')
+
+
+def render_to_buffer(shop_list):
+    register_fonts()
+    buffer = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    render_shop_list(shop_list, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def stream_shop_list(shop_list):
+    return read_chunks(render_to_buffer(shop_list))
@@ -0,0 +1,39 @@
+from .cache import bump_versions, get_version
+from .models import Tag
+
+TAG_REGISTRY_VERSION_KEY = 'tag_registry_version'
+
+
+class TagRegistry:
+    # Теги загружаются один раз на процесс. Версия в кэше нужна, чтобы
+    # изменение тега в одном воркере сбрасывало реестр и в остальных
+    def __init__(self):
+        self._version = None
+        self._tags = []
+        self._by_slug = {}
+
+    def _load(self):
+        version = get_version(TAG_REGISTRY_VERSION_KEY)
+        if version != self._version:
+            tags = list(Tag.objects.order_by('pk'))
+            self._by_slug = {tag.slug: tag for tag in tags}
+            self._tags = tags
+            self._version = version
+
+    def all(self):
+        self._load()
+        return self._tags
+
+    def get(self, slug):
+        self._load()
+        return self._by_slug.get(slug)
+
+    def choices(self):
+        return [(tag.slug, tag.name) for tag in self.all()]
+
+    def invalidate(self):
+        self._version = None
+        bump_versions([TAG_REGISTRY_VERSION_KEY])
+
+
+tag_registry = TagRegistry()
@@ -0,0 +1,195 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .autocomplete import normalize
+from .models import Ingredient, Product, Recipe
+
+RECIPE_TABLE = Recipe._meta.db_table
+INGREDIENT_TABLE = Ingredient._meta.db_table
+PRODUCT_TABLE = Product._meta.db_table
+
+SQLITE_TITLES = "group_concat(p.title, ' ')"
+POSTGRES_TITLES = "string_agg(p.title, ' ')"
+
+WORD_RE = re.compile(r'\w+')
+
+
+def search_words(query):
+    # Из пользовательского ввода оставляем только слова: кавычки, скобки и
+    # операторы не должны попадать в синтаксис MATCH / to_tsquery
+    return WORD_RE.findall(normalize(query))
+
+
+def fold(column):
+    # normalize() заменяет ё на е, в индексе нужно то же самое
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+class SqliteRecipeSearch:
+    # Отдельная таблица FTS5, rowid совпадает с id рецепта. Колонки: название,
+    # описание и названия ингредиентов через пробел
+    table = 'recipes_recipe_fts'
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = %s", [self.table])
+            if cursor.fetchone():
+                return
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {self.table} USING fts5('
+                f"name, description, ingredients, tokenize='unicode61')")
+        self.rebuild()
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(self._insert_sql(''))
+
+    def update(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})',
+                recipe_ids)
+            cursor.execute(
+                self._insert_sql(f'WHERE r.id IN ({placeholders})'),
+                recipe_ids)
+
+    def _insert_sql(self, where):
+        return (
+            f'INSERT INTO {self.table} '
+            f'(rowid, name, description, ingredients) '
+            f"SELECT r.id, {fold('r.name')}, {fold('r.description')}, "
+            f"coalesce((SELECT {fold(SQLITE_TITLES)} "
+            f'FROM {INGREDIENT_TABLE} i '
+            f'JOIN {PRODUCT_TABLE} p ON p.id = i.ingredient_id '
+            f"WHERE i.recipe_id = r.id), '') "
+            f'FROM {RECIPE_TABLE} r {where}')
+
+    def search(self, queryset, query):
+        words = search_words(query)
+        if not words:
+            return queryset.none()
+        # Каждое слово ищется по префиксу: «томат» найдет «томатами»
+        match = ' '.join(f'"{word}"*' for word in words)
+        # Вес совпадения в названии выше, чем в ингредиентах и описании
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+            (match,)
+        )).annotate(search_rank=RawSQL(
+            f'SELECT bm25({self.table}, 10.0, 1.0, 4.0) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s '
+            f'AND rowid = "{RECIPE_TABLE}"."id"',
+            (match,)
+        )).order_by('search_rank', '-pub_date', '-pk')
+
+
+class PostgresRecipeSearch:
+    # tsvector с весами хранится в отдельной таблице под GIN-индексом:
+    # A - название, B - ингредиенты, C - описание
+    table = 'recipes_recipe_search'
+    config = 'russian'
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)', [self.table])
+            if cursor.fetchone()[0]:
+                return
+            cursor.execute(
+                f'CREATE TABLE {self.table} ('
+                f'recipe_id integer PRIMARY KEY '
+                f'REFERENCES {RECIPE_TABLE} (id) ON DELETE CASCADE, '
+                f'document tsvector NOT NULL)')
+            cursor.execute(
+                f'CREATE INDEX {self.table}_document '
+                f'ON {self.table} USING GIN (document)')
+        self.rebuild()
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(self._upsert_sql(''))
+
+    def update(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self._upsert_sql('WHERE r.id = ANY(%s)'),
+                           [recipe_ids])
+
+    def _upsert_sql(self, where):
+        config = self.config
+
+        def vector(column, weight):
+            return (f"setweight(to_tsvector('{config}', "
+                    f"coalesce({fold(column)}, '')), '{weight}')")
+
+        return (
+            f'INSERT INTO {self.table} (recipe_id, document) '
+            f"SELECT r.id, {vector('r.name', 'A')} || "
+            f"{vector(POSTGRES_TITLES, 'B')} || "
+            f"{vector('r.description', 'C')} "
+            f'FROM {RECIPE_TABLE} r '
+            f'LEFT JOIN {INGREDIENT_TABLE} i ON i.recipe_id = r.id '
+            f'LEFT JOIN {PRODUCT_TABLE} p ON p.id = i.ingredient_id '
+            f'{where} GROUP BY r.id '
+            f'ON CONFLICT (recipe_id) DO UPDATE SET document = '
+            f'EXCLUDED.document')
+
+    def search(self, queryset, query):
+        words = search_words(query)
+        if not words:
+            return queryset.none()
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT recipe_id FROM {self.table} '
+            f"WHERE document @@ to_tsquery('{self.config}', %s)",
+            (tsquery,)
+        )).annotate(search_rank=RawSQL(
+            f"SELECT ts_rank(document, to_tsquery('{self.config}', %s)) "
+            f'FROM {self.table} WHERE recipe_id = "{RECIPE_TABLE}"."id"',
+            (tsquery,)
+        )).order_by('-search_rank', '-pub_date', '-pk')
+
+
+class SimpleRecipeSearch:
+    # Для остальных баз: icontains без ранжирования и без индекса
+    def create(self):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def update(self, recipe_ids):
+        pass
+
+    def search(self, queryset, query):
+        words = search_words(query)
+        if not words:
+            return queryset.none()
+        for word in words:
+            queryset = queryset.filter(
+                Q(name__icontains=word)
+                | Q(description__icontains=word)
+                | Q(pk__in=Ingredient.objects.filter(
+                    ingredient__title__icontains=word
+                ).values('recipe_id')))
+        return queryset
+
+
+BACKENDS = {
+    'sqlite': SqliteRecipeSearch(),
+    'postgresql': PostgresRecipeSearch(),
+}
+
+
+def recipe_search():
+    return BACKENDS.get(connection.vendor) or SimpleRecipeSearch()
@@ -0,0 +1,89 @@
+import csv
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .models import Ingredient, Product, Recipe, Tag
+
+User = get_user_model()
+
+TAGS = (
+    ('завтрак', 'breakfast', 'orange'),
+    ('обед', 'lunch', 'green'),
+    ('ужин', 'dinner', 'purple'),
+)
+
+RECIPE_INGREDIENTS = 5
+
+
+def seed_tags():
+    return [Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color})[0]
+            for name, slug, color in TAGS]
+
+
+def seed_products(path=None):
+    path = path or settings.BASE_DIR / 'ingredients.csv'
+    with open(path, encoding='utf-8', newline='') as csv_file:
+        Product.objects.bulk_create(
+            Product(title=title, unit=unit)
+            for title, unit in csv.reader(csv_file))
+    return list(Product.objects.all())
+
+
+def seed_users(count, prefix='bench'):
+    start = User.objects.filter(username__startswith=prefix).count()
+    User.objects.bulk_create(
+        [User(username=f'{prefix}{i}', email=f'{prefix}{i}@bench.test')
+         for i in range(start, start + count)])
+    return list(User.objects.filter(username__startswith=prefix))
+
+
+def seed_recipes(count, authors, tags, batch_size=5000, products=None):
+    # С products у рецептов появляются ингредиенты, а в названии - один из
+    # них, чтобы по корпусу было что искать
+    through = Recipe.tags.through
+    ingredients_count = RECIPE_INGREDIENTS if products else 0
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        recipes = Recipe.objects.bulk_create(
+            [Recipe(author=random.choice(authors),
+                    name=recipe_name(i, products),
+                    description='Описание рецепта ' * 20,
+                    cook_time=random.randint(5, 120),
+                    ingredients_count=ingredients_count)
+             for i in range(created, created + size)])
+        if recipes[0].pk is None:
+            recipes = Recipe.objects.order_by('-pk')[:size]
+        through.objects.bulk_create(
+            [through(recipe_id=recipe.pk, tag_id=tag.pk)
+             for recipe in recipes
+             for tag in random.sample(tags, random.randint(1, 2))])
+        if products:
+            Ingredient.objects.bulk_create(
+                [Ingredient(recipe_id=recipe.pk, ingredient=product,
+                            amount=random.randint(1, 500))
+                 for recipe in recipes
+                 for product in random.sample(products, RECIPE_INGREDIENTS)])
+        created += size
+
+
+def recipe_name(number, products):
+    if not products:
+        return f'Рецепт {number}'
+    return f'{random.choice(products).title.capitalize()} по-домашнему'
+
+
+def seed_relations(model, users, target_ids, per_user, field='recipe',
+                   batch_size=5000):
+    # Избранное, покупки и подписки: каждому пользователю per_user случайных
+    # целей. Повторы и подписка на себя отбрасываются
+    per_user = min(per_user, len(target_ids))
+    model.objects.bulk_create(
+        [model(user_id=user.pk, **{f'{field}_id': target_id})
+         for user in users
+         for target_id in random.sample(target_ids, per_user)
+         if not (field == 'author' and target_id == user.pk)],
+        batch_size=batch_size, ignore_conflicts=True)
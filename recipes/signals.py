@@ -0,0 +1,145 @@
+from django.db import connections
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save, pre_delete)
+from django.dispatch import receiver
+
+from foodgram.settings import INGREDIENT_SEARCH_BACKEND
+from users.models import Subscription
+
+from .autocomplete import product_index
+from .cache import (bump_listing_version, bump_page_version,
+                    bump_shop_list_versions)
+from .managers import change_ingredients_count, touch_recipes
+from .models import (Favorite, Ingredient, Product, Purchase, Recipe, Tag,
+                     User)
+from .registry import tag_registry
+from .search import recipe_search
+from .thumbnails import schedule_thumbnails
+
+
+@receiver([post_save, post_delete], sender=Purchase)
+def purchase_changed(sender, instance, **kwargs):
+    bump_shop_list_versions([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    bump_shop_list_versions(Purchase.objects.filter(
+        recipe_id=instance.recipe_id
+    ).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, created, **kwargs):
+    recipe_search().update([instance.pk])
+    schedule_thumbnails(instance)
+    if not created:
+        bump_shop_list_versions(instance.purchase_set.values_list(
+            'user_id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+def product_changed(sender, instance, created, **kwargs):
+    product_index.invalidate()
+    if not created:
+        bump_shop_list_versions(Purchase.objects.filter(
+            recipe__ingredient__ingredient=instance
+        ).values_list('user_id', flat=True))
+        recipe_search().update(instance.ingredient_set.values_list(
+            'recipe_id', flat=True).distinct())
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    tag_registry.invalidate()
+
+
+# Карточка рецепта кэшируется по времени изменения, поэтому все, что на
+# ней видно, должно это время обновлять
+@receiver([post_save, pre_delete], sender=Tag)
+def tag_recipes_changed(sender, instance, **kwargs):
+    touch_recipes(instance.recipe_set.all())
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            touch_recipes(Recipe.objects.filter(pk=instance.pk))
+        elif pk_set:
+            touch_recipes(Recipe.objects.filter(pk__in=pk_set))
+
+
+# Версия списков входит в ключи закэшированного числа страниц
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def listing_changed(sender, **kwargs):
+    bump_listing_version()
+
+
+# Избранное и подписки меняют только списки своего пользователя
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=Subscription)
+def user_listing_changed(sender, instance, **kwargs):
+    bump_listing_version(instance.user_id)
+
+
+# Версия публичного содержимого входит в ключи страниц для гостей
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def page_content_changed(sender, **kwargs):
+    bump_page_version()
+
+
+@receiver(post_save, sender=User)
+def profile_changed(sender, created, update_fields, **kwargs):
+    # Вход пользователя обновляет только last_login, страницы не меняются
+    if not created and set(update_fields or ()) != {'last_login'}:
+        bump_page_version()
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    recipe_search().update([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_added(sender, instance, created, **kwargs):
+    if created:
+        change_ingredients_count(instance.recipe_id, 1)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    change_ingredients_count(instance.recipe_id, -1)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    recipe_search().update([instance.recipe_id])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, **kwargs):
+    product_index.invalidate()
+
+
+@receiver(post_migrate)
+def create_extensions(sender, using, **kwargs):
+    connection = connections[using]
+    if (sender.name == 'recipes' and connection.vendor == 'postgresql'
+            and INGREDIENT_SEARCH_BACKEND == 'postgres'):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    # без --run-syncdb таблиц приложения может еще не быть
+    if (sender.name == 'recipes' and Recipe._meta.db_table
+            in connections[using].introspection.table_names()):
+        recipe_search().create()
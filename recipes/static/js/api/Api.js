@@ -114,6 +114,26 @@ class Api {
             }
             return Promise.reject(e.statusText)
         })
+  }
+  // operations: [{kind: 'favorite' | 'purchase' | 'subscription',
+  //               action: 'add' | 'remove', id: id}, ...]
+  batch (operations) {
+    return fetch(`/batch/`, {
+      method: 'POST',
+      headers: {
+        'X-CSRFToken': document.getElementsByName('csrfmiddlewaretoken')[0].value,
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({
+        operations: operations
+      })
+    })
+        .then( e => {
+            if(e.ok) {
+                return e.json()
+            }
+            return Promise.reject(e.statusText)
+        })
   }
     getIngredients  (text)  {
         return fetch(`/ingredients?query=${text}`, {
@@ -64,6 +64,7 @@ function Ingredients() {
         clearValue,
         getValue,
         addIngredient,
+        eventDelete,
         dropdown
     }
 }
@@ -92,5 +93,9 @@ const ingredients = Ingredients();
 formDropdownItems.addEventListener('click', ingredients.dropdown);
 // вешаем слушатель на кнопку
 addIng.addEventListener('click', ingredients.addIngredient);
+// удаление ингредиентов, пришедших с сервера при редактировании
+document.querySelectorAll('.form__field-item-ingredient').forEach(item => {
+    item.addEventListener('click', ingredients.eventDelete);
+});
 
 
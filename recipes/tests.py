@@ -1,9 +1,48 @@
-from django.test import Client, TestCase
+import json
+import os
+import re
+from base64 import urlsafe_b64encode
+from io import BytesIO, StringIO
+from tempfile import NamedTemporaryFile, mkdtemp
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
+
+from foodgram.query_budget import (QueryBudget, QueryBudgetExceeded,
+                                   QueryBudgetMiddleware, fingerprint)
+from foodgram.settings import AUTOCOMPLETE_LIMIT
+from users.models import Subscription, UserStats
+
+from .autocomplete import TrigramProductSearch, product_index
+from .cache import (get_listing_version, get_page_version,
+                    get_shop_list_version, page_cache_stats)
+from .forms import RecipeForm
+from .managers import (UserState, apply_toggles, get_cookable_recipes,
+                       get_shop_list)
+from .models import Favorite, Ingredient, Product, Purchase, Recipe, Tag, User
+from .paginators import CursorPaginator, cached_count
+from .registry import tag_registry
+from .search import recipe_search
+from .seed import seed_recipes, seed_tags, seed_users
+from .thumbnails import (THUMBNAIL_SIZES, build_thumbnails,
+                         generate_thumbnails, save_thumbnails)
 
-from users.models import Subscription
 
-from .models import Favorite, Ingredient, Product, Purchase, Recipe, Tag, User
+def stub_font():
+    # arial.ttf в репозитории нет: для тестов под его именем регистрируется
+    # Vera из поставки reportlab
+    return patch('recipes.pdf.FONT_FILE', 'Vera.ttf')
 
 
 def create_recipe(author, name, tag):
@@ -344,6 +383,17 @@ class TestSubscriptionPage(TestCase):
             'Cool user', response.content.decode(),
             msg='На странице подписок должен быть добавленный автор')
 
+    def test_recipe_count_without_stats(self):
+        tag = Tag.objects.get()
+        for i in range(4):
+            create_recipe(self.user1, f'Рецепт {i}', tag)
+        UserStats.objects.all().delete()
+        self.client.force_login(self.user2)
+        response = self.client.get(reverse('my_subscriptions'))
+        self.assertIn(
+            'Еще 2 рецептов', response.content.decode(),
+            msg='Число рецептов считается и без строки UserStats')
+
 
 class TestPurchasePage(TestCase):
     """
@@ -396,12 +446,12 @@ class TestIngredientQuery(TestCase):
         )
 
     def test_not_auth_user(self):
-        response = self.client.get('/ingredients?query=хл', follow=True)
-        redirect_url = f'/{response.redirect_chain[0][0].split("?")[0]}'
-        self.assertEqual(
-            reverse('login'), redirect_url,
-            msg=('GET-запрос ингредиента должен неавторизованного'
-                 ' юзера перенаправлять на страницу входа'))
+        response = self.client.get('/ingredients?query=хл')
+        self.assertIsInstance(
+            response.json(), list,
+            msg=('Справочник ингредиентов общий и доступен без авторизации,'
+                 ' чтобы ответы кэшировались браузером и nginx'))
+        self.assertIn('public', response['Cache-Control'])
 
     def test_auth_user(self):
         self.client.force_login(self.user)
@@ -668,3 +718,1412 @@ class TestPurchaseButton(TestCase):
         self.assertEqual(
             data_incoming_2['success'], 'false',
             msg='При попытке повторно удалить из покупок success = false')
+
+
+class TestShopList(TestCase):
+    """
+    Тесты для сборки списка покупок.
+
+    Проверяет, что одинаковые продукты из разных рецептов суммируются, а
+    количество запросов к базе не зависит от размера списка покупок.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.product = Product.objects.create(title='соль', unit='г')
+
+    def add_recipes(self, count):
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                author=self.user, name=f'recipe {i}',
+                description='test', cook_time=5)
+            Ingredient.objects.create(
+                recipe=recipe, ingredient=self.product, amount=1.5)
+            Purchase.objects.create(user=self.user, recipe=recipe)
+
+    def test_totals(self):
+        self.add_recipes(3)
+        shop_list = list(get_shop_list(self.user))
+        self.assertEqual(
+            shop_list,
+            [{'ingredient__title': 'соль', 'ingredient__unit': 'г',
+              'total': 4.5}],
+            msg='Одинаковые продукты должны суммироваться')
+
+    def test_query_count(self):
+        for count in (1, 10, 200):
+            self.add_recipes(count)
+            with self.assertNumQueries(1):
+                list(get_shop_list(self.user))
+
+    def test_download(self):
+        self.add_recipes(40)
+        self.client.force_login(self.user)
+        with stub_font():
+            response = self.client.get(reverse('download_purchases'))
+            self.assertTrue(
+                response.streaming,
+                msg='Список покупок должен отдаваться потоком')
+            content = b''.join(response.streaming_content)
+        self.assertTrue(
+            content.startswith(b'%PDF'),
+            msg='В ответ на запрос должен приходить PDF-файл')
+
+
+class TestShopListCache(TestCase):
+    """
+    Тесты для кэша PDF со списком покупок.
+
+    Проверяет, что версия списка покупок меняется при изменении покупок и
+    ингредиентов, а повторный запрос с тем же ETag получает ответ 304.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.recipe = create_recipe(self.user, 'Test recipe', tag)
+        Purchase.objects.create(user=self.user, recipe=self.recipe)
+
+    def test_version(self):
+        version = get_shop_list_version(self.user.id)
+        self.assertEqual(
+            version, get_shop_list_version(self.user.id),
+            msg='Без изменений версия списка покупок не должна меняться')
+        ingredient = self.recipe.ingredient_set.first()
+        ingredient.amount = 10
+        ingredient.save()
+        self.assertNotEqual(
+            version, get_shop_list_version(self.user.id),
+            msg='Изменение ингредиента должно сбрасывать кэш списка')
+        version = get_shop_list_version(self.user.id)
+        Purchase.objects.filter(user=self.user).delete()
+        self.assertNotEqual(
+            version, get_shop_list_version(self.user.id),
+            msg='Изменение покупок должно сбрасывать кэш списка')
+
+    def test_not_modified(self):
+        self.client.force_login(self.user)
+        with stub_font():
+            response = self.client.get(reverse('download_purchases'))
+            content = b''.join(response.streaming_content)
+        etag = response['ETag']
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('download_purchases'))
+        self.assertEqual(
+            content, b''.join(response.streaming_content),
+            msg='Повторный запрос должен отдавать PDF из кэша')
+        response = self.client.get(
+            reverse('download_purchases'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(
+            response.status_code, 304,
+            msg='Неизменившийся список покупок должен отдавать 304')
+
+
+class TestUserState(TestCase):
+    """
+    Тесты для состояния пользователя на карточках рецептов.
+
+    Проверяет, что избранное и покупки загружаются одним запросом, а на
+    карточках отмечены только добавленные рецепты.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.favorite = create_recipe(self.user, 'Favorite recipe', tag)
+        self.purchase = create_recipe(self.user, 'Purchase recipe', tag)
+        Favorite.objects.create(user=self.user, recipe=self.favorite)
+        Purchase.objects.create(user=self.user, recipe=self.purchase)
+
+    def test_state(self):
+        with self.assertNumQueries(1):
+            state = UserState(self.user)
+        self.assertEqual(state.favorites, {self.favorite.id})
+        self.assertEqual(state.purchases, {self.purchase.id})
+
+    def test_cards(self):
+        self.client.force_login(self.user)
+        content = self.client.get(reverse('index')).content.decode()
+        self.assertEqual(
+            content.count('icon-favorite_active'), 1,
+            msg='Отмечен должен быть только рецепт из избранного')
+        self.assertEqual(
+            content.count('Рецепт добавлен'), 1,
+            msg='Отмечен должен быть только рецепт из списка покупок')
+
+
+class TestCounters(TestCase):
+    """
+    Тесты для счетчиков избранного, покупок и рецептов.
+
+    Проверяет, что счетчики меняются при добавлении и удалении из избранного
+    и списка покупок, а команда reconcile_counters исправляет расхождения.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.recipe = create_recipe(self.user, 'Test recipe', tag)
+        self.client.force_login(self.user)
+
+    def test_favorite(self):
+        self.client.post(
+            reverse('add_favorite'), data={'id': self.recipe.id},
+            content_type='application/json')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1,
+                         msg='Добавление в избранное увеличивает счетчик')
+        self.client.delete(reverse('del-favorite', args=[self.recipe.id]))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0,
+                         msg='Удаление из избранного уменьшает счетчик')
+
+    def test_purchase(self):
+        self.client.post(
+            reverse('add-purchase'), data={'id': self.recipe.id},
+            content_type='application/json')
+        response = self.client.get(reverse('index'))
+        self.assertIn(
+            'id="counter">1<', response.content.decode(),
+            msg='В шапке должно быть количество рецептов в списке покупок')
+        self.client.delete(reverse('del-purchase', args=[self.recipe.id]))
+        self.assertEqual(UserStats.objects.get(user=self.user).purchase_count,
+                         0, msg='Удаление из покупок уменьшает счетчик')
+
+    def test_reconcile(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Purchase.objects.create(user=self.user, recipe=self.recipe)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.recipe.refresh_from_db()
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(stats.purchase_count, 1)
+        self.assertEqual(stats.recipe_count, 1)
+
+
+class TestSubscriptionFeed(TestCase):
+    """
+    Тесты для ленты подписок.
+
+    Проверяет, что у автора показываются три последних рецепта, а количество
+    запросов не зависит от числа рецептов у авторов.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.authors = []
+        for i in range(3):
+            author = User.objects.create(
+                username=f'author {i}', email=f'author{i}@test.test')
+            Subscription.objects.create(user=self.user, author=author)
+            self.authors.append(author)
+        self.client.force_login(self.user)
+
+    def add_recipes(self, count):
+        for author in self.authors:
+            for i in range(count):
+                create_recipe(author, f'{author.username} recipe {i}',
+                              self.tag)
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def get_feed(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my_subscriptions'))
+        return response.content.decode(), len(queries)
+
+    def test_feed(self):
+        self.add_recipes(1)
+        _, small_count = self.get_feed()
+        self.add_recipes(4)
+        content, large_count = self.get_feed()
+        self.assertEqual(
+            small_count, large_count,
+            msg='Число запросов не должно зависеть от количества рецептов')
+        self.assertEqual(
+            content.count('class="recipe__title"'), 9,
+            msg='У каждого автора должно быть не больше трех рецептов')
+        self.assertIn('Еще 2 рецептов', content)
+        self.assertIn('author 0 recipe 3', content,
+                      msg='Показываются последние рецепты автора')
+
+
+class TestCursorPagination(TestCase):
+    """
+    Тесты для пагинации по курсору.
+
+    Проверяет, что по курсорам можно пройти все рецепты вперед и назад без
+    пропусков и повторов, а на странице с курсором есть ссылки навигации.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        for i in range(15):
+            create_recipe(self.user, f'recipe {i}', tag)
+
+    def test_walk(self):
+        paginator = CursorPaginator(
+            Recipe.objects.all(), 6, ('-pub_date', '-pk'))
+        page = paginator.get_page()
+        pages = [[recipe.id for recipe in page]]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            pages.append([recipe.id for recipe in page])
+        self.assertEqual(
+            sum(pages, []), list(Recipe.objects.values_list('id', flat=True)),
+            msg='Курсоры должны проходить все рецепты по порядку')
+        self.assertEqual([len(ids) for ids in pages], [6, 6, 3])
+        page = paginator.get_page(page.previous_cursor)
+        self.assertEqual([recipe.id for recipe in page], pages[1],
+                         msg='Курсор назад должен вести на прошлую страницу')
+
+    def test_invalid_cursor(self):
+        paginator = CursorPaginator(
+            Recipe.objects.all(), 6, ('-pub_date', '-pk'))
+        page = paginator.get_page('broken')
+        self.assertEqual(len(page), 6,
+                         msg='Неверный курсор открывает первую страницу')
+        self.assertFalse(page.has_previous())
+
+    def test_crafted_cursor(self):
+        def cursor(data):
+            return urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+        payloads = ('ab', 5, [False, ['abc', 'x']], [False, 5],
+                    [False, [None, None]], [False, [{}, 1]], [False, ['x']],
+                    [False, [[1], 1]], ['yes', ['2020-01-01', 1]], [])
+        self.client.force_login(self.user)
+        for payload in payloads:
+            for url in (reverse('index'), reverse('my_subscriptions')):
+                response = self.client.get(url, {'cursor': cursor(payload)})
+                self.assertEqual(
+                    response.status_code, 200,
+                    msg=f'Курсор {payload!r} не должен ронять {url}')
+            page = CursorPaginator(
+                Recipe.objects.all(), 6, ('-pub_date', '-pk')
+            ).get_page(cursor(payload))
+            self.assertEqual(len(page), 6,
+                             msg='Неверный курсор открывает первую страницу')
+            self.assertFalse(page.has_previous())
+
+    def test_cached_count(self):
+        queryset = Recipe.objects.all()
+        self.assertEqual(cached_count(queryset), 15)
+        with self.assertNumQueries(0):
+            cached_count(queryset)
+        Recipe.objects.first().delete()
+        self.assertEqual(
+            cached_count(queryset), 14,
+            msg='Изменение рецептов должно сбрасывать кэш количества')
+
+    def test_scoped_count(self):
+        recipes = Recipe.objects.all()
+        favorites = Recipe.objects.filter(favorite__user=self.user)
+        cached_count(recipes)
+        cached_count(favorites, self.user.pk)
+        reader = User.objects.create(username='reader', email='r@test.test')
+        Favorite.objects.create(user=reader, recipe=recipes.first())
+        with self.assertNumQueries(0):
+            cached_count(recipes)
+            cached_count(favorites, self.user.pk)
+        Favorite.objects.create(user=self.user, recipe=recipes.first())
+        self.assertEqual(
+            cached_count(favorites, self.user.pk), 1,
+            msg='Свое избранное должно сбрасывать кэш своего списка')
+        with self.assertNumQueries(0):
+            cached_count(recipes)
+
+    def test_view(self):
+        response = self.client.get(f'{reverse("index")}?cursor=')
+        content = response.content.decode()
+        self.assertEqual(content.count('class="card"'), 6)
+        self.assertIn('?cursor=', content,
+                      msg='На странице должна быть ссылка на следующую')
+
+
+class TestTagQuery(TestCase):
+    """
+    Тесты для фильтрации рецептов по тегам.
+
+    Проверяет режимы «любой из тегов» и «все теги» и отсутствие дублей
+    у рецептов с несколькими тегами.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        breakfast = Tag.objects.create(name='завтрак', slug='breakfast')
+        lunch = Tag.objects.create(name='обед', slug='lunch')
+        self.both = create_recipe(self.user, 'both', breakfast)
+        self.both.tags.add(lunch)
+        self.lunch = create_recipe(self.user, 'lunch', lunch)
+        create_recipe(self.user, 'breakfast', breakfast)
+
+    def test_any(self):
+        self.assertEqual(
+            list(Recipe.objects.with_tags(['lunch'])),
+            [self.lunch, self.both])
+        self.assertEqual(
+            Recipe.objects.with_tags(['lunch', 'breakfast']).count(), 3,
+            msg='Рецепт с несколькими тегами не должен дублироваться')
+
+    def test_all(self):
+        self.assertEqual(
+            list(Recipe.objects.with_tags(['lunch', 'breakfast'],
+                                          match_all=True)),
+            [self.both])
+
+
+class TestCardQueries(TestCase):
+    """
+    Тесты для количества запросов на страницах со списком рецептов.
+
+    Проверяет, что число запросов на странице не зависит от количества
+    авторов и тегов у рецептов.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.tags = [Tag.objects.create(name='завтрак', slug='breakfast'),
+                     Tag.objects.create(name='обед', slug='lunch')]
+        for i in range(6):
+            author = User.objects.create(
+                username=f'author {i}', email=f'author{i}@test.test')
+            recipe = create_recipe(author, f'recipe {i}', self.tags[0])
+            recipe.tags.add(self.tags[1])
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        tag_registry.all()
+
+    def test_index(self):
+        # COUNT, страница рецептов и теги рецептов
+        with self.assertNumQueries(3):
+            self.client.get(reverse('index'))
+
+    def test_favorites(self):
+        self.client.force_login(self.user)
+        # Сессия, пользователь, COUNT, страница рецептов, теги рецептов,
+        # избранное и покупки пользователя, счетчик покупок
+        with self.assertNumQueries(7):
+            self.client.get(reverse('favorite'))
+
+
+class TestTagRegistry(TestCase):
+    """
+    Тесты для реестра тегов.
+
+    Проверяет, что теги читаются из памяти без запросов к базе, а изменение
+    тега сбрасывает реестр.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.tag = Tag.objects.create(
+            name='завтрак', slug='breakfast', color='orange')
+
+    def test_registry(self):
+        self.assertEqual(tag_registry.all(), [self.tag])
+        with self.assertNumQueries(0):
+            tag_registry.all()
+            self.assertEqual(tag_registry.get('breakfast'), self.tag)
+        self.tag.color = 'green'
+        self.tag.save()
+        self.assertEqual(tag_registry.get('breakfast').color, 'green',
+                         msg='Изменение тега должно сбрасывать реестр')
+
+    def test_tag_bar(self):
+        response = self.client.get(reverse('index'))
+        self.assertIn(
+            'tags__checkbox_style_orange', response.content.decode(),
+            msg='На главной странице должна быть панель тегов')
+
+    def test_form(self):
+        form = RecipeForm(data={'tags': ['breakfast']})
+        form.is_valid()
+        self.assertEqual(form.cleaned_data['tags'], [self.tag])
+
+
+class TestProductIndex(TestCase):
+    """
+    Тесты для поиска ингредиентов по префиксу.
+
+    Проверяет поиск без учета регистра и различий е/ё, ограничение
+    количества результатов и обновление индекса при добавлении продукта.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        Product.objects.bulk_create([
+            Product(title='Ёжевика', unit='г'),
+            Product(title='ежевичный сок', unit='стакан'),
+            Product(title='яблоко', unit='шт.'),
+        ] + [Product(title=f'чай {i}', unit='г') for i in range(30)])
+
+    def test_search(self):
+        titles = [item['title'] for item in product_index.search('ЕЖЕВ')]
+        self.assertEqual(titles, ['Ёжевика', 'ежевичный сок'])
+        self.assertEqual(len(product_index.search('чай')),
+                         AUTOCOMPLETE_LIMIT,
+                         msg='Количество подсказок должно быть ограничено')
+        self.assertEqual(product_index.search(''), [])
+
+    def test_fuzzy(self):
+        Product.objects.bulk_create([
+            Product(title='молоко', unit='мл'),
+            Product(title='сгущённое молоко', unit='г'),
+        ])
+        product_index.invalidate()
+        titles = [item['title'] for item in product_index.search('молоко')]
+        self.assertEqual(
+            titles, ['молоко', 'сгущённое молоко'],
+            msg='Слово в середине названия тоже должно находиться')
+        titles = [item['title'] for item in product_index.search('малоко')]
+        self.assertEqual(titles[0], 'молоко',
+                         msg='Поиск должен находить продукт с опечаткой')
+
+    def test_rebuild(self):
+        product_index.search('я')
+        Product.objects.create(title='яйцо', unit='шт.')
+        self.assertEqual(
+            [item['title'] for item in product_index.search('я')],
+            ['яблоко', 'яйцо'],
+            msg='Новый продукт должен попадать в индекс')
+
+    def test_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f'{reverse("ingredients")}?query=ябл')
+        self.assertEqual(response.json(), [{'title': 'яблоко', 'unit': 'шт.'}])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен PostgreSQL с pg_trgm')
+class TestTrigramProductSearch(TestCase):
+    """
+    Тесты для поиска ингредиентов средствами PostgreSQL.
+
+    Проверяет, что совпадения по префиксу идут выше похожих названий, а
+    названия с «ё» находятся так же, как в индексе в памяти.
+    """
+
+    def setUp(self):
+        cache.clear()
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        Product.objects.bulk_create([
+            Product(title='Ёжевика', unit='г'),
+            Product(title='ежевика замороженная в пакете', unit='г'),
+            Product(title='свежая ежевика', unit='г'),
+            Product(title='яблоко', unit='шт.'),
+        ])
+        self.search = TrigramProductSearch()
+
+    def titles(self, query):
+        return [item['title'] for item in self.search.search(query)]
+
+    def test_ranking(self):
+        self.assertEqual(
+            self.titles('ЕЖЕВИКА'),
+            ['Ёжевика', 'ежевика замороженная в пакете', 'свежая ежевика'],
+            msg='Совпадения по префиксу должны идти выше похожих названий')
+        self.assertEqual(self.titles(''), [])
+
+    def test_yo(self):
+        self.assertEqual(self.titles('ёжев'), self.titles('ежев'))
+        self.assertEqual(
+            self.titles('ежев')[0], 'Ёжевика',
+            msg='Название с «ё» должно находиться по префиксу с «е»')
+        self.assertEqual(
+            self.titles('ежев')[:2],
+            [item['title'] for item in product_index.search('ежев')][:2],
+            msg='Оба поиска должны находить одно и то же')
+
+
+class TestIngredientCache(TestCase):
+    """
+    Тесты для кэширования подсказок ингредиентов.
+
+    Проверяет, что повторный запрос с тем же префиксом не обращается к базе,
+    ответ с тем же ETag получает 304, а изменение продуктов сбрасывает кэш.
+    """
+
+    def setUp(self):
+        cache.clear()
+        Product.objects.create(title='яблоко', unit='шт.')
+
+    def test_cache(self):
+        url = f'{reverse("ingredients")}?query=Ябл'
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            repeat = self.client.get(f'{reverse("ingredients")}?query=ябл')
+        self.assertEqual(response.json(), repeat.json())
+        self.assertEqual(
+            self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+            304)
+        Product.objects.create(title='яблочный сок', unit='стакан')
+        response = self.client.get(url)
+        self.assertEqual(
+            len(response.json()), 2,
+            msg='Изменение продуктов должно сбрасывать кэш подсказок')
+
+
+class TestLoadProducts(TestCase):
+    """
+    Тесты для команды загрузки справочника продуктов.
+
+    Проверяет, что повторная загрузка не создает дублей, а у существующих
+    продуктов обновляются единицы измерения.
+    """
+
+    def load(self, rows):
+        with NamedTemporaryFile('w', suffix='.csv', encoding='utf-8',
+                                delete=False) as csv_file:
+            csv_file.write('\n'.join(rows))
+        self.addCleanup(os.remove, csv_file.name)
+        call_command('load_products', csv_file.name, batch_size=2,
+                     stdout=StringIO())
+
+    def test_load(self):
+        self.load(['соль,г', 'сахар,г', 'соль,г', 'мука,г'])
+        self.assertEqual(Product.objects.count(), 3)
+        self.load(['соль,кг', 'перец,г'])
+        self.assertEqual(Product.objects.count(), 4,
+                         msg='Повторная загрузка не должна создавать дубли')
+        self.assertEqual(Product.objects.get(title='соль').unit, 'кг')
+
+    def test_shop_list_reset(self):
+        self.load(['соль,г'])
+        user = User.objects.create(username='buyer', email='b@test.test')
+        recipe = Recipe.objects.create(author=user, name='Суп',
+                                       description='суп', cook_time=5)
+        Ingredient.objects.create(recipe=recipe, amount=5,
+                                  ingredient=Product.objects.get())
+        Purchase.objects.create(user=user, recipe=recipe)
+        self.client.force_login(user)
+        url = reverse('download_purchases')
+        with stub_font():
+            etag = self.client.get(url)['ETag']
+            page_version = get_page_version()
+            self.load(['соль,кг'])
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200,
+                         msg='Смена единиц должна сбрасывать список покупок')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotEqual(
+            get_page_version(), page_version,
+            msg='Смена единиц должна сбрасывать кэш страниц гостей')
+        page_version = get_page_version()
+        self.load(['соль,кг'])
+        self.assertEqual(get_page_version(), page_version,
+                         msg='Без изменений кэш страниц не сбрасывается')
+
+
+GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+       b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+       b'\x01\x00;')
+
+
+@override_settings(MEDIA_ROOT=mkdtemp())
+class TestRecipeForm(TestCase):
+    """
+    Тесты для сохранения рецепта с ингредиентами.
+
+    Проверяет, что ингредиенты ищутся одним запросом, сохраняются вместе с
+    рецептом, а при редактировании неизмененные строки не пересоздаются.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        Tag.objects.create(name='завтрак', slug='breakfast')
+        for title in ('соль', 'сахар', 'мука'):
+            Product.objects.create(title=title, unit='г')
+        self.client.force_login(self.user)
+
+    def post(self, url, ingredients):
+        data = {'name': 'Блины', 'cook_time': 30, 'description': 'Вкусно',
+                'tags': ['breakfast'],
+                'image': SimpleUploadedFile('pic.gif', GIF, 'image/gif'),
+                'nameIngredient': [title for title, _ in ingredients],
+                'valueIngredient': [amount for _, amount in ingredients]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        product_queries = [query for query in queries
+                           if 'FROM "recipes_product"' in query['sql']]
+        self.assertEqual(len(product_queries), 1,
+                         msg='Ингредиенты должны искаться одним запросом')
+        return response
+
+    def amounts(self, recipe):
+        return dict(recipe.ingredient_set.values_list(
+            'ingredient__title', 'amount'))
+
+    def test_create_and_edit(self):
+        self.post(reverse('new_recipe'), [('соль', 1), ('сахар', 2)])
+        recipe = Recipe.objects.get(name='Блины')
+        self.assertEqual(self.amounts(recipe), {'соль': 1, 'сахар': 2})
+        self.assertEqual(list(recipe.tags.values_list('slug', flat=True)),
+                         ['breakfast'])
+        salt = recipe.ingredient_set.get(ingredient__title='соль')
+        with CaptureQueriesContext(connection) as queries:
+            self.post(reverse('edit_recipe', args=[recipe.id]),
+                      [('соль', 1), ('мука', 3)])
+        deletes = [query for query in queries if query['sql'].startswith(
+            'DELETE FROM "recipes_ingredient"')]
+        self.assertEqual(len(deletes), 1,
+                         msg='Удаленные ингредиенты - одним запросом')
+        loads = [query for query in queries if query['sql'].startswith(
+            'SELECT "recipes_ingredient"."id"')]
+        self.assertEqual(len(loads), 1,
+                         msg='Удаляемые строки не должны загружаться снова')
+        self.assertEqual(self.amounts(recipe), {'соль': 1, 'мука': 3})
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredients_count, 2)
+        self.assertTrue(
+            recipe.ingredient_set.filter(pk=salt.pk).exists(),
+            msg='Неизмененный ингредиент не должен пересоздаваться')
+
+    def test_unknown_product(self):
+        response = self.post(reverse('new_recipe'), [('сода', 1)])
+        self.assertIn('Нет таких ингредиентов: сода',
+                      response.content.decode())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_invalid_amounts(self):
+        for amount in ('nan', 'inf', '-inf', '0'):
+            form = RecipeForm(data={'nameIngredient': ['соль'],
+                                    'valueIngredient': [amount]})
+            self.assertFalse(form.is_valid(), msg=f'Количество {amount}')
+            self.assertIn('Неверное количество для «соль»',
+                          str(form.errors))
+        form = RecipeForm(data={'nameIngredient': ['соль', 'сахар'],
+                                'valueIngredient': ['1']})
+        self.assertFalse(form.is_valid(),
+                         msg='Списки названий и количеств разной длины')
+        self.assertIn('Укажите количество для каждого ингредиента',
+                      str(form.errors))
+
+
+class TestRecipeSearch(TestCase):
+    """
+    Тесты для полнотекстового поиска рецептов.
+
+    Проверяет поиск по названию, описанию и ингредиентам, ранжирование,
+    обновление индекса при изменении рецепта и страницу поиска.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.pancakes = Recipe.objects.create(
+            author=self.user, name='Блины на молоке',
+            description='Тонкие блины', cook_time=30)
+        self.salad = Recipe.objects.create(
+            author=self.user, name='Салат',
+            description='Подавать с блинами', cook_time=10)
+        Ingredient.objects.create(
+            recipe=self.salad, amount=2,
+            ingredient=Product.objects.create(title='Свёкла', unit='шт'))
+
+    def search(self, query):
+        return list(recipe_search().search(Recipe.objects.all(), query))
+
+    def test_search(self):
+        self.assertEqual(self.search('блин'), [self.pancakes, self.salad],
+                         msg='Совпадение в названии должно быть выше')
+        self.assertEqual(self.search('СВЕКЛ'), [self.salad],
+                         msg='Поиск должен идти и по ингредиентам')
+        self.assertEqual(self.search('блины молок'), [self.pancakes])
+        self.assertEqual(self.search('"блин* ('),
+                         [self.pancakes, self.salad],
+                         msg='Спецсимволы не должны ломать запрос')
+        self.assertEqual(self.search('  '), [])
+
+    def test_index_update(self):
+        self.pancakes.name = 'Оладьи'
+        self.pancakes.save()
+        self.assertEqual(self.search('оладьи'), [self.pancakes])
+        Ingredient.objects.filter(recipe=self.salad).delete()
+        self.assertEqual(self.search('свекла'), [])
+        self.salad.delete()
+        self.assertEqual(self.search('блин'), [self.pancakes])
+
+    def test_page(self):
+        self.pancakes.tags.add(self.tag)
+        response = self.client.get(reverse('search'), {'q': 'блин'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page']),
+                         [self.pancakes, self.salad])
+        response = self.client.get(
+            reverse('search'), {'q': 'блин', 'tag': 'breakfast'})
+        self.assertEqual(list(response.context['page']), [self.pancakes])
+
+
+class TestCookableRecipes(TestCase):
+    """
+    Тесты для подбора рецептов по имеющимся продуктам.
+
+    Проверяет счетчик ингредиентов рецепта, ранжирование по доле
+    имеющихся ингредиентов и ответ эндпоинта.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.flour, self.milk, self.eggs, self.salt = [
+            Product.objects.create(title=title, unit='г')
+            for title in ('мука', 'молоко', 'яйца', 'соль')]
+        self.pancakes = self.create('Блины',
+                                    self.flour, self.milk, self.eggs)
+        self.omelette = self.create('Омлет', self.milk, self.eggs)
+
+    def create(self, name, *products):
+        recipe = Recipe.objects.create(
+            author=self.user, name=name, description='test', cook_time=5)
+        for product in products:
+            Ingredient.objects.create(
+                recipe=recipe, ingredient=product, amount=1)
+        return recipe
+
+    def test_ingredients_count(self):
+        self.pancakes.refresh_from_db()
+        self.assertEqual(self.pancakes.ingredients_count, 3)
+        Ingredient.objects.filter(recipe=self.pancakes,
+                                  ingredient=self.eggs).delete()
+        self.pancakes.refresh_from_db()
+        self.assertEqual(self.pancakes.ingredients_count, 2)
+
+    def test_ranking(self):
+        products = [self.milk.pk, self.eggs.pk, self.salt.pk]
+        with self.assertNumQueries(2):
+            result = get_cookable_recipes(products)
+        self.assertEqual(
+            [(recipe, matched, total) for recipe, matched, total in result],
+            [(self.omelette, 2, 2), (self.pancakes, 2, 3)],
+            msg='Рецепты должны быть упорядочены по доле продуктов')
+        self.assertEqual(get_cookable_recipes([self.salt.pk]), [])
+
+    def test_without_counter(self):
+        Recipe.objects.update(ingredients_count=0)
+        result = get_cookable_recipes([self.milk.pk, self.eggs.pk])
+        self.assertEqual(
+            result, [(self.omelette, 2, 2), (self.pancakes, 2, 3)],
+            msg='Рецепты без счетчика ингредиентов не должны пропадать')
+
+    def test_endpoint(self):
+        response = self.client.get(
+            reverse('cookable_recipes'), {'product': [self.flour.pk]})
+        self.assertEqual(response.json(), [{
+            'id': self.pancakes.pk,
+            'name': 'Блины',
+            'url': reverse('recipe', args=[self.pancakes.pk]),
+            'matched': 1,
+            'total': 3,
+            'coverage': 0.33,
+        }])
+        response = self.client.get(
+            reverse('cookable_recipes'), {'product': 'мука'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestCardCache(TestCase):
+    """
+    Тесты для кэширования карточек рецептов.
+
+    Проверяет, что карточка берется из кэша, пока рецепт не изменен, а
+    состояние избранного и покупок пользователя всегда актуально.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.recipe = create_recipe(self.user, 'Блины', self.tag)
+
+    def get_index(self):
+        return self.client.get(reverse('index')).content.decode()
+
+    def test_card_cache(self):
+        self.assertIn('Блины', self.get_index())
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Оладьи')
+        self.assertIn('Блины', self.get_index(),
+                      msg='Неизмененная карточка должна браться из кэша')
+        self.recipe.name = 'Оладьи'
+        self.recipe.save()
+        self.assertIn('Оладьи', self.get_index())
+
+    def test_tag_change(self):
+        self.get_index()
+        self.tag.name = 'поздний завтрак'
+        self.tag.save()
+        self.assertIn('поздний завтрак', self.get_index())
+        other = Tag.objects.create(name='ужин', slug='dinner')
+        self.recipe.tags.add(other)
+        self.assertIn('ужин', self.get_index())
+
+    def test_user_state(self):
+        self.client.force_login(self.user)
+        self.assertNotIn('icon-favorite_active', self.get_index())
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        self.assertIn('icon-favorite_active', self.get_index(),
+                      msg='Состояние избранного не должно кэшироваться')
+
+
+class TestPageCache(TestCase):
+    """
+    Тесты для кэша страниц гостей.
+
+    Проверяет, что повторный запрос гостя не обращается к базе, ключ не
+    зависит от порядка тегов и лишних параметров, а изменения рецептов
+    сбрасывают кэш.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        Tag.objects.create(name='обед', slug='lunch')
+        self.recipe = create_recipe(self.user, 'Блины', self.tag)
+
+    def test_hit(self):
+        url = reverse('recipe', args=[self.recipe.id])
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertIn('Блины', response.content.decode())
+        self.assertEqual(page_cache_stats(), (1, 1))
+
+    def test_params(self):
+        url = reverse('index')
+        self.client.get(url, {'tag': ['breakfast', 'lunch']})
+        response = self.client.get(
+            url, {'tag': ['lunch', 'breakfast'], 'utm_source': 'test'})
+        self.assertEqual(response['X-Page-Cache'], 'HIT',
+                         msg='Порядок тегов не должен влиять на ключ')
+        response = self.client.get(url, {'tag': 'lunch'})
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+
+    def test_invalidation(self):
+        url = reverse('profile', args=[self.user.id])
+        self.client.get(url)
+        self.recipe.name = 'Оладьи'
+        self.recipe.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertIn('Оладьи', response.content.decode())
+
+    def test_authenticated(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_relations_keep_cache(self):
+        url = reverse('index')
+        self.client.get(url)
+        reader = User.objects.create(username='reader', email='r@test.test')
+        Favorite.objects.create(user=reader, recipe=self.recipe)
+        Subscription.objects.create(user=reader, author=self.user)
+        apply_toggles(reader, {('favorite', self.recipe.id): False,
+                               ('subscription', self.user.id): False})
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT',
+                         msg='Избранное и подписки не видны гостю, кэш '
+                             'страниц сбрасываться не должен')
+
+
+def jpeg():
+    buffer = BytesIO()
+    Image.new('RGB', (4, 4), 'white').save(buffer, 'JPEG')
+    return SimpleUploadedFile('pic.jpg', buffer.getvalue(), 'image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=mkdtemp())
+class TestThumbnails(TestCase):
+    """
+    Тесты для предварительного построения миниатюр.
+
+    Проверяет построение всех размеров, использование готовых миниатюр в
+    шаблонах и команду build_thumbnails.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Блины', description='test', cook_time=5,
+            image=jpeg())
+
+    def test_build(self):
+        build_thumbnails(self.recipe.pk)
+        self.recipe.refresh_from_db()
+        thumbnails = self.recipe.thumbnails
+        self.assertEqual(thumbnails['source'], self.recipe.image.name)
+        self.assertEqual(set(thumbnails) - {'source'}, set(THUMBNAIL_SIZES))
+        self.assertEqual(thumbnails['card']['width'], 364)
+        response = self.client.get(reverse('index'))
+        self.assertIn(thumbnails['card']['url'], response.content.decode(),
+                      msg='Карточка должна брать готовую миниатюру')
+
+    def test_stale_image(self):
+        thumbnails = generate_thumbnails(self.recipe.image)
+        self.recipe.image = jpeg()
+        self.recipe.save()
+        self.assertEqual(save_thumbnails(self.recipe.pk, thumbnails), 0,
+                         msg='Миниатюры старой картинки не сохраняются')
+
+    def test_missing_image(self):
+        os.remove(self.recipe.image.path)
+        for url in (reverse('index'),
+                    reverse('recipe', args=[self.recipe.id])):
+            response = self.client.get(url)
+            self.assertEqual(
+                response.status_code, 200,
+                msg='Пропавшая картинка не должна ломать страницу')
+            self.assertIn('Блины', response.content.decode())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('build_thumbnails', workers=1, stdout=out)
+        self.assertIn('для 1 из 1', out.getvalue())
+        out = StringIO()
+        call_command('build_thumbnails', workers=1, stdout=out)
+        self.assertIn('для 0 из 0', out.getvalue(),
+                      msg='Готовые миниатюры не перестраиваются')
+
+
+class TestToggles(TestCase):
+    """
+    Тесты для добавления и удаления избранного, покупок и подписок.
+
+    Проверяет, что повторный клик не создает дубликатов и не меняет
+    счетчики, а каждое действие выполняется одним запросом к таблице.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.author = User.objects.create(
+            username='Test author',
+            email='author@test.test',
+            password='12345six')
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.recipe = create_recipe(self.author, 'Блины', self.tag)
+        self.client.force_login(self.user)
+
+    def post(self, url, object_id, table):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, json.dumps({'id': object_id}),
+                content_type='application/json')
+        self.assertEqual(
+            len([query for query in queries if table in query['sql']]), 1,
+            msg='Действие должно выполняться одним запросом')
+        return response
+
+    def test_favorite(self):
+        url = reverse('add_favorite')
+        for success in ('true', 'false'):
+            response = self.post(url, self.recipe.id, 'recipes_favorite')
+            self.assertEqual(response.json(), {'success': success})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(Favorite.objects.count(), 1)
+        url = reverse('del-favorite', args=[self.recipe.id])
+        for success in ('true', 'false'):
+            response = self.client.delete(url)
+            self.assertEqual(response.json(), {'success': success})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_purchase(self):
+        version = get_shop_list_version(self.user.id)
+        for _ in range(2):
+            self.post(reverse('add-purchase'), self.recipe.id,
+                      'recipes_purchase')
+        self.assertEqual(Purchase.objects.count(), 1)
+        self.assertEqual(self.user.stats.purchase_count, 1)
+        self.assertNotEqual(get_shop_list_version(self.user.id), version,
+                            msg='Список покупок должен сбрасываться')
+
+    def test_subscription(self):
+        for _ in range(2):
+            self.post(reverse('subscription'), self.author.id,
+                      'users_subscription')
+        self.assertEqual(Subscription.objects.count(), 1)
+        response = self.client.delete(
+            reverse('delete_subscription', args=[self.author.id]))
+        self.assertEqual(response.json(), {'success': 'true'})
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_not_found(self):
+        response = self.client.post(
+            reverse('add_favorite'), json.dumps({'id': 0}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.delete(reverse('del-purchase', args=[0]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            reverse('add_favorite'), json.dumps({'id': 'abc'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestBatchToggle(TestCase):
+    """
+    Тесты для пакетного переключения избранного, покупок и подписок.
+
+    Проверяет применение операций по порядку, пропуск несуществующих
+    объектов, пересчет счетчиков и число запросов.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='Test user',
+            email='test@test.test',
+            password='12345six')
+        self.author = User.objects.create(
+            username='Test author',
+            email='author@test.test',
+            password='12345six')
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.recipes = [create_recipe(self.author, f'Рецепт {i}', self.tag)
+                        for i in range(3)]
+        self.client.force_login(self.user)
+
+    def batch(self, operations):
+        return self.client.post(
+            reverse('batch'), json.dumps({'operations': operations}),
+            content_type='application/json')
+
+    def test_batch(self):
+        first, second, third = [recipe.id for recipe in self.recipes]
+        Favorite.objects.create(user=self.user, recipe_id=third)
+        response = self.batch([
+            {'kind': 'favorite', 'action': 'add', 'id': first},
+            {'kind': 'favorite', 'action': 'add', 'id': second},
+            {'kind': 'favorite', 'action': 'remove', 'id': second},
+            {'kind': 'favorite', 'action': 'remove', 'id': third},
+            {'kind': 'favorite', 'action': 'add', 'id': 0},
+            {'kind': 'purchase', 'action': 'add', 'id': first},
+            {'kind': 'purchase', 'action': 'add', 'id': second},
+            {'kind': 'subscription', 'action': 'add', 'id': self.author.id},
+        ])
+        data = response.json()
+        self.assertEqual(data['favorites'], [first])
+        self.assertEqual(data['purchases'], [first, second])
+        self.assertEqual(data['subscriptions'], [self.author.id])
+        self.assertEqual(data['purchase_count'], 2)
+        self.assertEqual(data['favorites_count'],
+                         {str(first): 1, str(second): 0, str(third): 0})
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).purchase_count, 2)
+
+    def test_repeat(self):
+        operations = [{'kind': 'purchase', 'action': 'add',
+                       'id': recipe.id} for recipe in self.recipes]
+        self.batch(operations)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch(operations)
+        self.assertEqual(response.json()['purchase_count'], 3)
+        self.assertEqual(Purchase.objects.count(), 3)
+        inserts = [query for query in queries
+                   if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1,
+                         msg='Вставки должны идти одним запросом')
+
+    def test_remove(self):
+        for recipe in self.recipes:
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        version = get_listing_version(self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch([{'kind': 'favorite', 'action': 'remove',
+                                    'id': recipe.id}
+                                   for recipe in self.recipes])
+        self.assertEqual(response.json()['favorites'], [])
+        deletes = [query for query in queries
+                   if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1,
+                         msg='Удаления должны идти одним запросом')
+        self.assertFalse(
+            [query for query in queries
+             if query['sql'].startswith('SELECT "recipes_favorite"."id"')],
+            msg='Удаляемые строки не должны загружаться')
+        self.assertNotEqual(get_listing_version(self.user.pk), version,
+                            msg='Версия списков обновляется и без сигналов')
+        self.assertEqual(set(Recipe.objects.values_list(
+            'favorites_count', flat=True)), {0})
+
+    def test_invalid(self):
+        for operations in ([{'kind': 'like', 'action': 'add', 'id': 1}],
+                           [{'kind': 'favorite', 'action': 'add'}],
+                           'favorite'):
+            self.assertEqual(self.batch(operations).status_code, 400)
+
+
+class TestQueryPlans(TestCase):
+    """
+    Тесты для планов запросов страниц.
+
+    Выполняет EXPLAIN для каждого SELECT, который делают страницы, и
+    проверяет, что ни одна большая таблица не читается полным проходом.
+    """
+    # Маленькие справочники, которые читаются целиком намеренно
+    FULL_SCAN_ALLOWED = {'recipes_tag'}
+
+    def setUp(self):
+        cache.clear()
+        tags = seed_tags()
+        self.users = seed_users(5)
+        products = Product.objects.bulk_create(
+            [Product(title=f'продукт {i}', unit='г') for i in range(30)])
+        products = list(Product.objects.all())
+        seed_recipes(50, self.users, tags, products=products)
+        self.user, self.author = self.users[:2]
+        self.recipe = Recipe.objects.filter(author=self.author).first()
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Purchase.objects.create(user=self.user, recipe=self.recipe)
+        Subscription.objects.create(user=self.user, author=self.author)
+        self.product = products[0]
+        self.client.force_login(self.user)
+
+    def explain(self, sql, params=None):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # На маленьких данных PostgreSQL и так выберет Seq Scan,
+                # поэтому проверяем, есть ли вообще подходящий индекс
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}', params)
+                pattern = r'Seq Scan on (\w+)'
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                pattern = r'^SCAN (?:TABLE )?(\w+)(?!.*INDEX)'
+            plan = [row[-1] for row in cursor.fetchall()]
+        return {match.group(1) for line in plan
+                for match in [re.search(pattern, line)] if match}
+
+    def assert_indexed(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            # captured_queries хранят SQL с подставленными параметрами
+            scans = self.explain(sql) - self.FULL_SCAN_ALLOWED
+            self.assertFalse(
+                scans, msg=f'{url}: полный проход по {scans} в {sql}')
+
+    def test_explain(self):
+        self.assertEqual(
+            self.explain('SELECT id FROM recipes_recipe WHERE name = %s',
+                         ['Блины']),
+            {'recipes_recipe'},
+            msg='Полный проход должен обнаруживаться')
+
+    def test_listing_pages(self):
+        self.assert_indexed(reverse('index'))
+        self.assert_indexed(reverse('index'), {'tag': 'breakfast'})
+        self.assert_indexed(reverse('index'), {'cursor': ''})
+        self.assert_indexed(reverse('profile', args=[self.author.id]))
+        self.assert_indexed(reverse('favorite'))
+        self.assert_indexed(reverse('my_subscriptions'))
+
+    def test_recipe_pages(self):
+        self.assert_indexed(reverse('recipe', args=[self.recipe.id]))
+        self.assert_indexed(reverse('purchases'))
+        self.assert_indexed(reverse('search'), {'q': 'рецепт'})
+        self.assert_indexed(reverse('cookable_recipes'),
+                            {'product': self.product.id})
+
+
+class TestQueryBudgets(TestCase):
+    """
+    Тесты для числа запросов на страницах.
+
+    Закрепляет бюджет запросов для основных страниц на данных, близких к
+    реальным, и проверяет, что ни один запрос не повторяется (N+1).
+    """
+
+    def setUp(self):
+        cache.clear()
+        tags = seed_tags()
+        self.users = seed_users(10)
+        Product.objects.bulk_create(
+            [Product(title=f'продукт {i}', unit='г') for i in range(30)])
+        products = list(Product.objects.all())
+        seed_recipes(60, self.users, tags, products=products)
+        self.user, self.author = self.users[:2]
+        recipes = list(Recipe.objects.all()[:20])
+        Favorite.objects.bulk_create(
+            [Favorite(user=self.user, recipe=recipe) for recipe in recipes])
+        Purchase.objects.bulk_create(
+            [Purchase(user=self.user, recipe=recipe) for recipe in recipes])
+        Subscription.objects.bulk_create(
+            [Subscription(user=self.user, author=author)
+             for author in self.users[1:]])
+        self.recipe = recipes[0]
+        tag_registry.all()
+        self.client.force_login(self.user)
+
+    def assert_budget(self, limit, url, params=None):
+        with QueryBudget(limit) as budget:
+            response = self.client.get(url, params)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(budget.duplicates, {},
+                         msg=f'{url}: повторяющиеся запросы')
+
+    def test_listing_pages(self):
+        self.assert_budget(7, reverse('index'))
+        self.assert_budget(7, reverse('index'), {'tag': 'lunch'})
+        self.assert_budget(9, reverse('profile', args=[self.author.id]))
+        self.assert_budget(7, reverse('favorite'))
+        self.assert_budget(6, reverse('my_subscriptions'))
+
+    def test_recipe_pages(self):
+        self.assert_budget(9, reverse('recipe', args=[self.recipe.id]))
+        self.assert_budget(4, reverse('purchases'))
+
+    def test_download(self):
+        with stub_font():
+            self.assert_budget(3, reverse('download_purchases'))
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 5 AND name = 'a''b'"),
+            fingerprint("SELECT * FROM t WHERE id = 12 AND name = 'c'"),
+            msg='Запросы, отличающиеся значениями, должны совпадать')
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s)'),
+            msg='Длина списка IN не должна влиять на отпечаток')
+
+    def test_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with QueryBudget(1):
+                list(Recipe.objects.all()[:1])
+                list(Tag.objects.all()[:1])
+        with QueryBudget() as budget:
+            for recipe in Recipe.objects.all()[:3]:
+                recipe.author.username
+        self.assertEqual(len(budget.duplicates), 1,
+                         msg='N+1 должен попасть в повторы')
+
+    def test_middleware_headers(self):
+        def get_response(request):
+            for recipe in Recipe.objects.all()[:3]:
+                recipe.author.username
+            return HttpResponse()
+
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryBudgetMiddleware(get_response)
+        with override_settings(DEBUG=True):
+            middleware = QueryBudgetMiddleware(get_response)
+        with self.assertLogs('foodgram.query_budget', 'WARNING'):
+            response = middleware(RequestFactory().get('/'))
+        self.assertEqual(response['X-Query-Count'], '4',
+                         msg='Нет заголовка с числом запросов')
+        self.assertEqual(response['X-Query-Duplicates'], '3',
+                         msg='Нет заголовка с числом повторов')
+        self.assertIn('X-Query-Time', response)
+
+
+class TestBenchmark(TestCase):
+    """Тесты для генератора данных и прогона нагрузки."""
+
+    def test_seed_and_replay(self):
+        cache.clear()
+        Product.objects.bulk_create(
+            [Product(title=f'продукт {i}', unit='г') for i in range(10)])
+        call_command('seed_bench', users=5, recipes=20, favorites=3,
+                     purchases=2, subscriptions=2, seed=1, stdout=StringIO())
+        self.assertEqual(Recipe.objects.count(), 20)
+        self.assertEqual(Favorite.objects.count(), 15)
+        self.assertEqual(Purchase.objects.count(), 10)
+        self.assertFalse(Subscription.objects.filter(
+            user=F('author')).exists(), msg='Подписка на себя')
+        self.assertEqual(
+            UserStats.objects.get(user__username='bench0').purchase_count, 2,
+            msg='Счетчики должны быть пересчитаны')
+
+        routes = [
+            {'name': 'index', 'path': '/?tag={tag}', 'weight': 3},
+            {'name': 'recipe', 'path': '/recipes/{recipe_id}/',
+             'auth': True},
+            {'name': 'add_favorite', 'method': 'POST',
+             'path': '/add-favorite/', 'body': {'id': '{recipe_id}'},
+             'auth': True},
+        ]
+        with NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8') \
+                as traffic, NamedTemporaryFile(suffix='.json') as output:
+            traffic.write('\n'.join(json.dumps(route) for route in routes))
+            traffic.flush()
+            call_command('bench_traffic', traffic.name, requests=50,
+                         warmup=0, users=2, seed=1, output=output.name,
+                         stdout=StringIO(), stderr=StringIO())
+            results = json.load(output)
+        self.assertEqual(set(results), {'index', 'recipe', 'add_favorite',
+                                        'total'})
+        self.assertEqual(results['total']['requests'], 50)
+        self.assertEqual(results['total']['errors'], 0,
+                         msg='Запросы не должны падать')
+        self.assertLessEqual(results['total']['p50'],
+                             results['total']['p99'])
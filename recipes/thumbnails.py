@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+from django.utils.timezone import now
+from sorl.thumbnail import get_thumbnail
+
+from foodgram.settings import THUMBNAIL_WORKERS
+
+from .cache import bump_page_version
+from .models import Recipe
+
+# Все размеры, в которых картинки рецептов показываются в шаблонах. Опции
+# те же, что у тега {% thumbnail %}, поэтому sorl находит готовые файлы
+THUMBNAIL_SIZES = {
+    'card': '364x240',
+    'detail': '480x480',
+    'purchase': '90x90',
+    'subscription': '72x72',
+}
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+
+executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS,
+                              thread_name_prefix='thumbnails')
+
+
+def get_recipe_thumbnail(recipe, size):
+    if not recipe.image:
+        return None
+    if recipe.thumbnails.get('source') == recipe.image.name:
+        return recipe.thumbnails[size]
+    # Миниатюры еще не построены - как раньше, строим на лету. Тег
+    # {% thumbnail %} глотал ошибки, здесь так же: без картинки шаблон
+    # просто ее не покажет
+    try:
+        thumbnail = get_thumbnail(recipe.image, THUMBNAIL_SIZES[size],
+                                  **THUMBNAIL_OPTIONS)
+    except Exception:
+        return None
+    # Для пропавшего или битого файла sorl возвращает миниатюру без размеров
+    return thumbnail if thumbnail.size else None
+
+
+def generate_thumbnails(image):
+    thumbnails = {'source': image.name}
+    for name, geometry in THUMBNAIL_SIZES.items():
+        thumbnail = get_thumbnail(image, geometry, **THUMBNAIL_OPTIONS)
+        thumbnails[name] = {'url': thumbnail.url,
+                            'width': thumbnail.width,
+                            'height': thumbnail.height}
+    return thumbnails
+
+
+def save_thumbnails(recipe_id, thumbnails):
+    # Условие на image: если картинку успели заменить, миниатюры старой
+    # не записываются. updated сбрасывает закэшированную карточку
+    return Recipe.objects.filter(
+        pk=recipe_id, image=thumbnails['source']
+    ).update(thumbnails=thumbnails, updated=now())
+
+
+def build_thumbnails(recipe_id):
+    try:
+        recipe = Recipe.objects.only('image').get(pk=recipe_id)
+        if (recipe.image and save_thumbnails(
+                recipe_id, generate_thumbnails(recipe.image))):
+            bump_page_version()
+    except Recipe.DoesNotExist:
+        pass
+    finally:
+        close_old_connections()
+
+
+def schedule_thumbnails(recipe):
+    # Миниатюры строятся в фоне после коммита, чтобы запрос на сохранение
+    # рецепта не ждал Pillow
+    if recipe.image and recipe.image.name != recipe.thumbnails.get('source'):
+        recipe_id = recipe.pk
+        transaction.on_commit(
+            lambda: executor.submit(build_thumbnails, recipe_id))
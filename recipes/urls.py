@@ -1,13 +1,15 @@
 from django.urls import path
 
-from .views import (add_favorite, add_purchase, add_subscription,
-                    delete_favorite, delete_purchase, delete_recipe,
-                    delete_subscription, download_pdf, edit_recipe,
-                    favorite_index, follow_index, get_ingredients, index,
-                    new_recipe, profile, purchases, recipe_detail)
+from .views import (add_favorite, add_purchase, add_subscription, batch_toggle,
+                    cookable_recipes, delete_favorite, delete_purchase,
+                    delete_recipe, delete_subscription, download_pdf,
+                    edit_recipe, favorite_index, follow_index, get_ingredients,
+                    index, new_recipe, profile, purchases, recipe_detail,
+                    search)
 
 urlpatterns = [
     path('', index, name='index'),
+    path('search/', search, name='search'),
     path('recipes/<int:recipe_id>/', recipe_detail, name='recipe'),
     path('recipes/<int:recipe_id>/edit/', edit_recipe, name='edit_recipe'),
     path('recipes/<int:recipe_id>/delete/', delete_recipe,
@@ -25,7 +27,9 @@ urlpatterns = [
     path('add-purchase/', add_purchase, name='add-purchase'),
     path('del-purchase/<int:recipe_id>/', delete_purchase,
          name='del-purchase'),
+    path('batch/', batch_toggle, name='batch'),
     path('ingredients', get_ingredients, name='ingredients'),
+    path('recipes/by-products/', cookable_recipes, name='cookable_recipes'),
     path('new/', new_recipe, name='new_recipe'),
     path('download_shoplist/', download_pdf,
          name='download_purchases'),
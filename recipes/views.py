@@ -1,36 +1,53 @@
 import json
+from hashlib import md5
 from urllib.parse import unquote
 
-import reportlab
-from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.http import HttpResponse, JsonResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.http import (require_GET, require_http_methods,
-                                          require_POST)
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import (condition, require_GET,
+                                          require_http_methods, require_POST)
+
+from foodgram.settings import (BATCH_MAX_OPERATIONS, INGREDIENTS_CACHE_MAX_AGE,
+                               INGREDIENTS_CACHE_TIMEOUT,
+                               SHOP_LIST_CACHE_TIMEOUT)
+from users.models import Subscription, UserStats
+
+from .autocomplete import PRODUCT_INDEX_VERSION_KEY, normalize, product_search
+from .cache import (INGREDIENTS_KEY, SHOP_LIST_PDF_KEY, anonymous_page_cache,
+                    get_shop_list_version, get_version)
+from .forms import RecipeForm
+from .managers import (TOGGLES, add_relation, add_subscription_status,
+                       apply_toggles, change_favorites_count,
+                       change_user_counter, delete_relation, extend_context,
+                       get_cookable_recipes, get_shop_list, get_subscriptions,
+                       paginate, tag_filter)
+from .models import Favorite, Purchase, Recipe, User
+from .pdf import SPOOL_MAX_SIZE, read_chunks, render_to_buffer
+from .registry import tag_registry
+from .search import recipe_search
 
-from foodgram.settings import PAGINATION_PAGE_SIZE
-from users.models import Subscription
 
-from .forms import RecipeForm
-from .managers import add_subscription_status, extend_context, tag_filter
-from .models import Favorite, Ingredient, Product, Purchase, Recipe, Tag, User
+def json_id(request):
+    try:
+        return int(json.loads(request.body.decode())['id'])
+    except (KeyError, TypeError, ValueError):
+        return None
 
 
 @require_GET
+@anonymous_page_cache
 def index(request):
     tags = request.GET.getlist('tag')
     recipe_list = tag_filter(Recipe, tags)
-    paginator = Paginator(recipe_list, PAGINATION_PAGE_SIZE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator, page = paginate(request, recipe_list)
     context = {
-        'tags': Tag.objects.all(),
+        'all_tags': tag_registry.all(),
         'page': page,
         'paginator': paginator
     }
@@ -42,18 +59,33 @@ def index(request):
 
 
 @require_GET
+def search(request):
+    query = request.GET.get('q', '').strip()
+    tags = request.GET.getlist('tag')
+    recipe_list = recipe_search().search(tag_filter(Recipe, tags), query)
+    paginator, page = paginate(request, recipe_list, ordering=None)
+    context = {
+        'all_tags': tag_registry.all(),
+        'page': page,
+        'paginator': paginator,
+        'query': query
+    }
+    user = request.user
+    if user.is_authenticated:
+        context['active'] = 'recipe'
+        extend_context(context, user)
+    return render(request, 'index.html', context)
+
+
+@require_GET
+@anonymous_page_cache
 def profile(request, user_id):
     author = get_object_or_404(User, id=user_id)
     tags = request.GET.getlist('tag')
     recipe_list = tag_filter(Recipe, tags)
-    paginator = Paginator(
-        recipe_list.filter(author=author),
-        PAGINATION_PAGE_SIZE
-    )
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator, page = paginate(request, recipe_list.filter(author=author))
     context = {
-        'tags': Tag.objects.all(),
+        'all_tags': tag_registry.all(),
         'author': author,
         'page': page,
         'paginator': paginator
@@ -66,8 +98,12 @@ def profile(request, user_id):
 
 
 @require_GET
+@anonymous_page_cache
 def recipe_detail(request, recipe_id):
-    recipe = get_object_or_404(Recipe, id=recipe_id)
+    recipe = get_object_or_404(
+        Recipe.objects.select_related('author').prefetch_related(
+            'tags', 'ingredient_set__ingredient'),
+        id=recipe_id)
     context = {
         'recipe': recipe,
     }
@@ -80,68 +116,45 @@ def recipe_detail(request, recipe_id):
 
 @login_required(login_url='/auth/login/')
 def follow_index(request):
-    queryset = request.user.follower.all()
-    paginator = Paginator(queryset, PAGINATION_PAGE_SIZE)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    queryset = get_subscriptions(request.user)
+    paginator, page = paginate(request, queryset, ordering=('-pk',),
+                               user_id=request.user.pk)
     return render(request,
                   "recipes/subscriptions.html",
                   {"page": page,
-                   "paginator": paginator,
-                   "page_number": page_number})
+                   "paginator": paginator})
 
 
 @login_required(login_url='auth/login/')
 @require_POST
 def add_subscription(request):
-    json_data = json.loads(request.body.decode())
-    author_id = json_data.get('id')
-    if not author_id:
+    author_id = json_id(request)
+    if author_id is None:
         return JsonResponse({'success': 'false', 'massage': 'id not found'},
                             status=400)
-    author = get_object_or_404(User, id=author_id)
-    follow = Subscription.objects.filter(user=request.user, author=author)
-    data = {'success': 'true'}
-    if follow.exists():
-        data['success'] = 'false'
-    else:
-        Subscription.objects.create(user=request.user, author=author)
-    return JsonResponse(data)
+    added = add_relation(Subscription, request.user, author=author_id)
+    if not added:
+        get_object_or_404(User.objects.only('pk'), id=author_id)
+    return JsonResponse({'success': 'true' if added else 'false'})
 
 
 @login_required(login_url='auth/login/')
 @require_http_methods('DELETE')
 def delete_subscription(request, author_id):
-    author = get_object_or_404(User, id=author_id)
-    data = {'success': 'true'}
-    follow = Subscription.objects.filter(
-        user=request.user, author=author)
-    if not follow.exists():
-        data['success'] = 'false'
-    follow.delete()
-    return JsonResponse(data)
+    deleted = delete_relation(Subscription, request.user, author=author_id)
+    if not deleted:
+        get_object_or_404(User.objects.only('pk'), id=author_id)
+    return JsonResponse({'success': 'true' if deleted else 'false'})
 
 
 @login_required(login_url='/auth/login/')
 def favorite_index(request):
     tags = request.GET.getlist('tag')
     user = request.user
-    recipe_lists = user.favorite_recipes.all()
-    if tags:
-        recipe_list = recipe_lists.prefetch_related(
-                'author', 'tags'
-            ).filter(
-                tags__slug__in=tags
-            ).distinct()
-    else:
-        recipe_list = recipe_lists.prefetch_related(
-                'author', 'tags'
-            ).all()
-    paginator = Paginator(recipe_list, PAGINATION_PAGE_SIZE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    recipe_list = user.favorite_recipes.cards().with_tags(tags)
+    paginator, page = paginate(request, recipe_list, user_id=user.pk)
     context = {
-        'tags': Tag.objects.all(),
+        'all_tags': tag_registry.all(),
         'page': page,
         'paginator': paginator
     }
@@ -153,110 +166,168 @@ def favorite_index(request):
 @login_required(login_url='auth/login/')
 @require_POST
 def add_favorite(request):
-    json_data = json.loads(request.body.decode())
-    recipe_id = json_data.get('id')
-    if not recipe_id:
+    recipe_id = json_id(request)
+    if recipe_id is None:
         return JsonResponse({'success': 'false', 'massage': 'id not found'},
                             status=400)
-    recipe = get_object_or_404(Recipe, id=recipe_id)
-    data = {'success': 'true'}
-    favorite = Favorite.objects.filter(user=request.user, recipe=recipe)
-    if favorite.exists():
-        data['success'] = 'false'
-    else:
-        Favorite.objects.create(user=request.user, recipe=recipe)
-    return JsonResponse(data)
+    with transaction.atomic():
+        added = add_relation(Favorite, request.user, recipe=recipe_id)
+        if added:
+            change_favorites_count(recipe_id, 1)
+    if not added:
+        get_object_or_404(Recipe.objects.only('pk'), id=recipe_id)
+    return JsonResponse({'success': 'true' if added else 'false'})
 
 
 @login_required(login_url='auth/login/')
 @require_http_methods('DELETE')
 def delete_favorite(request, recipe_id):
-    recipe = get_object_or_404(Recipe, id=recipe_id)
-    data = {'success': 'true'}
-    favorite = Favorite.objects.filter(user=request.user, recipe=recipe)
-    if not favorite.exists():
-        data['success'] = 'false'
-    favorite.delete()
-    return JsonResponse(data)
+    with transaction.atomic():
+        deleted = delete_relation(Favorite, request.user, recipe=recipe_id)
+        if deleted:
+            change_favorites_count(recipe_id, -deleted)
+    if not deleted:
+        get_object_or_404(Recipe.objects.only('pk'), id=recipe_id)
+    return JsonResponse({'success': 'true' if deleted else 'false'})
 
 
 @login_required(login_url='/auth/login/')
 def purchases(request):
     user = request.user
-    recipes = user.shop_list.all()
-    return render(request, "recipes/purchases.html", {"page": recipes})
+    recipes = user.shop_list.defer('description')
+    return render(request, "recipes/purchases.html",
+                  {"recipes_list": recipes})
 
 
 @login_required(login_url='auth/login/')
 @require_POST
 def add_purchase(request):
-    json_data = json.loads(request.body.decode())
-    recipe_id = json_data.get('id')
-    if not recipe_id:
+    recipe_id = json_id(request)
+    if recipe_id is None:
         return JsonResponse({'success': 'false', 'massage': 'id not found'},
                             status=400)
-    recipe = get_object_or_404(Recipe, id=recipe_id)
-    data = {'success': 'true'}
-    purchase = Purchase.objects.filter(user=request.user, recipe=recipe)
-    if purchase.exists():
-        data['success'] = 'false'
-    else:
-        Purchase.objects.create(user=request.user, recipe=recipe)
-    return JsonResponse(data)
+    with transaction.atomic():
+        added = add_relation(Purchase, request.user, recipe=recipe_id)
+        if added:
+            change_user_counter(request.user, 'purchase_count', 1)
+    if not added:
+        get_object_or_404(Recipe.objects.only('pk'), id=recipe_id)
+    return JsonResponse({'success': 'true' if added else 'false'})
 
 
 @login_required(login_url='auth/login/')
 @require_http_methods('DELETE')
 def delete_purchase(request, recipe_id):
-    recipe = get_object_or_404(Recipe, id=recipe_id)
-    data = {'success': 'true'}
-    purchase = Purchase.objects.filter(user=request.user, recipe=recipe)
-    if not purchase.exists():
-        data['success'] = 'false'
-    purchase.delete()
-    return JsonResponse(data)
+    with transaction.atomic():
+        deleted = delete_relation(Purchase, request.user, recipe=recipe_id)
+        if deleted:
+            change_user_counter(request.user, 'purchase_count', -deleted)
+    if not deleted:
+        get_object_or_404(Recipe.objects.only('pk'), id=recipe_id)
+    return JsonResponse({'success': 'true' if deleted else 'false'})
 
 
 @login_required(login_url='auth/login/')
+@require_POST
+def batch_toggle(request):
+    try:
+        operations = json.loads(request.body.decode())['operations']
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            raise ValueError('too many operations')
+        toggles = {}
+        # Операции применяются по порядку: для одной связи важна последняя
+        for operation in operations:
+            if (operation['kind'] not in TOGGLES
+                    or operation['action'] not in ('add', 'remove')):
+                raise ValueError('unknown operation')
+            toggles[operation['kind'], int(operation['id'])] = (
+                operation['action'] == 'add')
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'success': 'false',
+                             'massage': 'invalid operations'}, status=400)
+    data = apply_toggles(request.user, toggles)
+    data['success'] = 'true'
+    return JsonResponse(data)
+
+
+def ingredients_etag(request):
+    query = normalize(unquote(request.GET.get('query', '')))
+    return md5(
+        f'{get_version(PRODUCT_INDEX_VERSION_KEY)}:{query}'.encode()
+    ).hexdigest()
+
+
 @require_GET
+@condition(etag_func=ingredients_etag)
 def get_ingredients(request):
-    query = unquote(request.GET.get('query'))
-    data = list(Product.objects.filter(
-        title__startswith=query
-    ).values(
-        'title', 'unit'))
+    cache_key = INGREDIENTS_KEY.format(ingredients_etag(request))
+    data = cache.get(cache_key)
+    if data is None:
+        query = unquote(request.GET.get('query', ''))
+        data = product_search.search(query)
+        cache.set(cache_key, data, INGREDIENTS_CACHE_TIMEOUT)
+    response = JsonResponse(data, safe=False)
+    patch_cache_control(response, public=True,
+                        max_age=INGREDIENTS_CACHE_MAX_AGE)
+    return response
+
+
+@require_GET
+def cookable_recipes(request):
+    try:
+        product_ids = {int(pk) for pk in request.GET.getlist('product')}
+    except ValueError:
+        return JsonResponse({'success': 'false',
+                             'massage': 'invalid product id'}, status=400)
+    data = [{
+        'id': recipe.id,
+        'name': recipe.name,
+        'url': reverse('recipe', args=[recipe.id]),
+        'matched': matched,
+        'total': total,
+        'coverage': round(matched / total, 2),
+    } for recipe, matched, total in get_cookable_recipes(product_ids)]
     return JsonResponse(data, safe=False)
 
 
 @login_required(login_url='/auth/login/')
 @require_http_methods(['GET', 'POST'])
 def new_recipe(request):
-    form = RecipeForm(request.POST or None, files=request.FILES or None,
-                      initial={'author': request.user})
+    form = RecipeForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
-        form.save()
+        with transaction.atomic():
+            recipe = form.save(commit=False)
+            recipe.author = request.user
+            recipe.save()
+            form.save_m2m()
+            change_user_counter(request.user, 'recipe_count', 1)
         return redirect('index')
-    return render(request, 'recipes/recipe_form.html', {'form': form})
+    context = {'form': form,
+               'page_title': 'Создание рецепта',
+               'button_label': 'Создать рецепт',
+               'active': 'new_recipe'}
+    return render(request, 'recipes/recipe_form.html', context)
 
 
 @login_required(login_url='/auth/login/')
+@require_http_methods(['GET', 'POST'])
 def edit_recipe(request, recipe_id):
     recipe = get_object_or_404(Recipe, id=recipe_id)
     if recipe.author != request.user:
-        return redirect('recipe', id=recipe_id)
+        return redirect('recipe', recipe_id=recipe_id)
     form = RecipeForm(request.POST or None, files=request.FILES or None,
-                      instance=recipe, initial={'author': request.user})
-    tags = recipe.tags.all()
-    ingredients = Ingredient.objects.filter(recipe=recipe).all()
+                      instance=recipe)
+    if form.is_valid():
+        with transaction.atomic():
+            form.save()
+        return redirect('recipe', recipe_id=recipe.id)
     context = {'form': form,
-               'is_created': True,
+               'page_title': 'Редактирование рецепта',
+               'button_label': 'Сохранить',
                'recipe_id': recipe.id,
-               'tags': tags,
-               'ingredients': ingredients}
-    if form.is_valid():
-        form.save()
-        return redirect('recipe', recipe.id)
-    return render(request, 'recipes/recipe_new.html', context)
+               'ingredients': recipe.ingredient_set.select_related(
+                   'ingredient')}
+    return render(request, 'recipes/recipe_form.html', context)
 
 
 @login_required(login_url='/auth/login/')
@@ -264,46 +335,40 @@ def edit_recipe(request, recipe_id):
 def delete_recipe(request, recipe_id):
     recipe = get_object_or_404(Recipe, id=recipe_id)
     if recipe.author == request.user:
-        recipe.delete()
+        with transaction.atomic():
+            UserStats.objects.filter(user__purchase__recipe=recipe).update(
+                purchase_count=F('purchase_count') - 1)
+            recipe.delete()
+            change_user_counter(request.user, 'recipe_count', -1)
     return redirect('index')
 
 
+def shop_list_etag(request):
+    return md5(
+        f'{request.user.id}:{get_shop_list_version(request.user.id)}'.encode()
+    ).hexdigest()
+
+
 @login_required
+@condition(etag_func=shop_list_etag)
 def download_pdf(request):
-    reportlab.rl_config.TTFSearchPath.append(
-        str(settings.BASE_DIR) + "/Library/Fonts/"
-    )
-    user = get_object_or_404(User, username=request.user)
-    ing_dict = {}
-    shop_list = Purchase.objects.filter(user=user)
-    if shop_list.count() == 0:
-        return redirect('purchases')
-    for el in shop_list:
-        ingredients = Ingredient.objects.filter(recipe=el.recipe.id)
-        for ingredient in ingredients:
-            name = ingredient.ingredient.title
-            count = ingredient.amount
-            dimension = ingredient.ingredient.unit
-            if name not in ing_dict:
-                ing_dict[name] = [count, dimension]
-            else:
-                ing_dict[name][0] += count
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = 'attachment; filename="shopList.pdf"'
-    p = canvas.Canvas(response, pagesize=A4)
-    pdfmetrics.registerFont(TTFont("Arial", "arial.ttf"))
-    p.setFont("Arial", 20)
-    x = 50
-    y = 750
-    for num, el in enumerate(ing_dict):
-        if y <= 100:
-            y = 700
-            p.showPage()
-            p.setFont("Arial", 20)
-        p.drawString(
-            x, y, f"№{num + 1}: {el} - {ing_dict[el][0]} {ing_dict[el][1]}"
-        )
-        y -= 30
-    p.showPage()
-    p.save()
+    cache_key = SHOP_LIST_PDF_KEY.format(shop_list_etag(request))
+    content = cache.get(cache_key)
+    if content is not None:
+        chunks = [content]
+    else:
+        shop_list = get_shop_list(request.user)
+        if not shop_list:
+            return redirect('purchases')
+        buffer = render_to_buffer(shop_list)
+        content = buffer.read(SPOOL_MAX_SIZE + 1)
+        if len(content) <= SPOOL_MAX_SIZE:
+            buffer.close()
+            cache.set(cache_key, content, SHOP_LIST_CACHE_TIMEOUT)
+            chunks = [content]
+        else:
+            buffer.seek(0)
+            chunks = read_chunks(buffer)
+    response = StreamingHttpResponse(chunks, content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename="shopList.pdf"'
     return response
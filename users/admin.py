@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 
-from .models import Subscription
+from .models import Subscription, UserStats
 
 User = get_user_model()
 
@@ -13,3 +13,4 @@ class UserAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Subscription)
+admin.site.register(UserStats)
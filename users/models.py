@@ -20,3 +20,19 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}.'
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='stats')
+    purchase_count = models.PositiveIntegerField(
+        default=0, verbose_name='Рецептов в списке покупок')
+    recipe_count = models.PositiveIntegerField(
+        default=0, verbose_name='Рецептов автора')
+
+    class Meta:
+        verbose_name_plural = 'Счетчики пользователей'
+        verbose_name = 'Счетчики пользователя'
+
+    def __str__(self):
+        return f'{self.user}'
@@ -1,5 +1,7 @@
 from django import template
 
+from recipes.thumbnails import get_recipe_thumbnail
+
 register = template.Library()
 
 
@@ -10,14 +12,22 @@ def url_with_get(request, page):
     return query.urlencode()
 
 
+@register.filter
+def url_with_cursor(request, cursor):
+    query = request.GET.copy()
+    query.pop('page', None)
+    query['cursor'] = cursor
+    return query.urlencode()
+
+
+@register.filter
+def thumbnail_of(recipe, size):
+    return get_recipe_thumbnail(recipe, size)
+
+
 @register.filter
 def add_color(tag):
-    colors = {
-        'breakfast': 'orange',
-        'lunch': 'green',
-        'dinner': 'purple'
-    }
-    return colors[tag.slug]
+    return tag.color
 
 
 @register.filter